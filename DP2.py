@@ -1,27 +1,13 @@
-V, E = map(int, input().split())
-INF = 10**10
-cost = [[INF]*V for _ in range(V)] # 重み
-for e in range(E):
-    s, t, d = map(int,input().split())
-    cost[s][t] = d
+import sys
+import math
+import numpy as np
+from TSP_DP_en import held_karp
+from TSP_instance import load_edge_list
 
-dp = [[-1] * V for _ in range(1<<V)] # dp[S][v]
+cost = load_edge_list(sys.stdin) # 1行目に V E, 続くE行に s t d (sからtへの重みd)
 
-def dfs(S, v, dp):
-    if dp[S][v] != -1: # 訪問済みならメモを返す
-        return dp[S][v]
-    if S==(1<<V)-1 and v==0: # 全ての頂点を訪れて頂点0に戻ってきた
-        return 0 # もう動く必要はない
-
-    res = INF
-    for u in range(V):
-        if S>>u & 1 == 0: # 未訪問かどうか
-            res = min(res, dfs(S|1<<u, u, dp)+cost[v][u])
-    dp[S][v] = res
-    return res
-
-ans = dfs(0, 0, dp) # 頂点0からスタートする。ただし頂点0は未訪問とする
-if ans == INF:
+ans, tour = held_karp(cost, dtype=np.int64) # 頂点0からスタートして頂点0に戻ってくる
+if ans == math.inf:
     print(-1)
 else:
-    print (ans)
\ No newline at end of file
+    print (ans)
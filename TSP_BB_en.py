@@ -1,165 +1,711 @@
 import numpy as np
-from pandas import DataFrame
 import math
-import copy
+import heapq
+import itertools
+import multiprocessing
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from TSP_instance import as_matrix
+from TSP_kernels import resolve_backend, reduce_matrix as compiled_reduce_matrix
+
+# Counters and phase timers of one search, available as TSP.stats after getSuitableAns
+class SearchStats():
+    PHASES = ("heuristic", "bounding", "branching", "closing") # Warm start, relaxation of new nodes, choice of the branching route, closing 2x2 nodes
+
+    def __init__(self, timing=False):
+        self.timing = timing # Whether the phases are timed
+        self.nodes_checked = 0 # Nodes taken from the stack and evaluated
+        self.nodes_stacked = 0 # Nodes whose relaxation was below the temporary value
+        self.nodes_pruned = 0 # Nodes dropped because their relaxation was not below the temporary value
+        self.incumbent_updates = 0 # Number of times a shorter closed circuit was found
+        self.status = "complete" # Why the search stopped: "complete", "time_limit", "node_limit" or "gap_limit"
+        self.phase_times = dict.fromkeys(self.PHASES, 0.0) # Seconds spent in each phase, only when timing
+        self.suitable_val = math.inf # Temporary value when the search ended
+        self.lower_bound = math.inf # Smallest relaxation of the open nodes when the search ended
+        self.elapsed = 0.0 # Seconds spent in getSuitableAns
+
+    # Add the counters and timers of a search done by a worker process
+    def merge(self, other):
+        self.nodes_checked += other.nodes_checked
+        self.nodes_stacked += other.nodes_stacked
+        self.nodes_pruned += other.nodes_pruned
+        self.incumbent_updates += other.incumbent_updates
+        for phase in self.PHASES:
+            self.phase_times[phase] += other.phase_times[phase]
 
 class TSP():
-    def __init__(self, route_list):
-        self.route_df = DataFrame(route_list)
-        self.stack_search_nodes = [] # A group of nodes that have been stacked with solutions to the relaxation problem.
+    SEARCH_STRATEGIES = ("best", "depth", "dive") # best-first, depth-first, depth-first until the first closed circuit then best-first
+    TASK_NODES = 2000 # Nodes a worker process checks before it hands its open nodes back for rebalancing
+    BOUNDS = ("reduction", "1-tree", "lagrangian") # Row and column reduction, minimum 1-tree, 1-tree with Lagrange multipliers
+    LAGRANGIAN_ROOT_ITERATIONS = 100 # Subgradient steps at the root
+    LAGRANGIAN_NODE_ITERATIONS = 10 # Subgradient steps at other nodes, which start from the parent's multipliers
+    GAP_EVENT_NODES = 1000 # A "bound_gap" event is sent every time this many nodes have been checked
+
+    # backend selects the code of the matrix reductions, the Numba kernel or NumPy (see TSP_kernels.BACKENDS),
+    # the results are the same
+    def __init__(self, route_list, backend="auto"):
+        self.backend = resolve_backend(backend) # "numpy" or "numba"
+        self.__setRouteArr(as_matrix(route_list)) # Distance matrix, c_ij is the distance from city i to city j (route_list may be a DistanceProvider)
+        self.stack_search_nodes = [] # Heap of nodes that have been stacked with solutions to the relaxation problem.
+        self.stack_counter = itertools.count() # Insertion order, breaks ties between equal keys in the heap
+        self.strategy = "dive" # Search strategy, one of SEARCH_STRATEGIES
+        self.diving = True # Whether the heap is currently ordered depth-first
         self.present_nodes = [] # The node you are exploring (one or two)
         self.suitable_val = math.inf # Temporary value
-        self.suitable_ans = [] # Temporary solution
-        self.node_num = self.route_df.shape[0] # the number of node
-
-    # Return the smallest pair of [index, column] values in the given DataFrame.
-    def __minimumRoute(self, target_route_df):
-        min_index = target_route_df.idxmin(axis=1) # Minimum value column for each row
-        minimum = math.inf # Initial value of minimum value
-        loc = [-1, -1] # Initial value of position
-        for index, column in zip(min_index.index, min_index.values):
-            if math.isnan(column): # If all rows are inf, then NaN, which is not minimal
-                continue
-            if minimum > target_route_df[column][index]:
-                minimum = target_route_df[column][index] # Update the minimum value
-                loc = [index, column] # Update index and column positions
-        return loc
-
-    # Given a default DataFrame and an array of route choices, return the optimal value
-    def __calcSuitableSum(self, route_list):
-        route_df_tmp = copy.deepcopy(self.route_df)
-        route_length = 0
-        for route in route_list:
-            if route[2] == 0: # When you select this route
-                route_length += route_df_tmp[route[1]][route[0]] # Add to path length
-                if (route[1] in route_df_tmp.index and route[0] in route_df_tmp.columns):
-                    # If the corresponding element still exists in the DataFrame of the reduced path
-                    route_df_tmp[route[0]][route[1]] = math.inf
-                    # DataFrame[column][index], the reverse path of the corresponding path (2->1 when 1->2) is not adopted, so it is inf
-                route_df_tmp = route_df_tmp.drop(route[0], axis=0)
-                # Delete the row of the corresponding route
-                route_df_tmp = route_df_tmp.drop(route[1], axis=1)
-                # Delete the column of the corresponding route
-            else: # When this route is not selected
-                if (route[0] in route_df_tmp.index and route[1] in route_df_tmp.columns):
-                    # If the corresponding element still exists in the DataFrame of the reduced path
-                    route_df_tmp[route[1]][route[0]] = math.inf
-                    # Since we are not going to adopt it, we will use inf for the corresponding route.
-
-        min_sum = 0 # Add up the path length of the relaxation problem.
-        next_route = copy.deepcopy(route_df_tmp) # Keep the DataFrame at this point in next_route
-        for index in route_df_tmp.index: # Run on each line
-            min_tmp = route_df_tmp.loc[index, :].min() #  Get the minimum value of a row
-            min_sum += min_tmp # Add the minimum value
-            route_df_tmp.loc[index, :] = route_df_tmp.loc[index, :] - min_tmp # Subtract the minimum value from each element in the row
-        for column in route_df_tmp.columns: # Run on each line
-            min_tmp = route_df_tmp.loc[:, column].min() # Get the minimum value of a column
-            min_sum += min_tmp # Add the minimum value
-            route_df_tmp.loc[:, column] = route_df_tmp.loc[:, column] - min_tmp # Subtract the minimum value from each element in the column
-        route_length += min_sum # Add to path length
-        return route_length, next_route # DataFrame of the route length and the route at the node
-
-    # Check for a closed circuit.
-    def __checkClosedCircle(self, route_list, route_df_tmp):
-        # route_df_tmp is assumed to be 2x2
-        mini_route = self.__minimumRoute(route_df_tmp) # The [index, coumn] of the smallest element of route_df_tmp.
-        if mini_route == [-1, -1]: # When route_df_tmp is all inf
-            return False
-        mini_route.append(0) # Add 0 since this is the route to adopt
-        route_list.append(mini_route) # Add to route list
-        route_df_tmp = route_df_tmp.drop(mini_route[0], axis=0) # Delete the row
-        route_df_tmp = route_df_tmp.drop(mini_route[1], axis=1) # Delete the column
-        last_route = [route_df_tmp.index[0], route_df_tmp.columns[0]] # Get the rest of the elements
-        last_route.append(0) # Add 0 since this is the route to adopt
-        route_list.append(last_route) # Add to route list
-
-        label, counter = 0, 0 # label is the current position, counter is the number of moves
-        for i in range(self.node_num): # The maximum number of iterations is the number of nodes
-            for route in route_list:
-                if route[0] == label and route[2] == 0: # If the starting point is label and it is an adopted path, then
-                    new_label = route[1] # Update the label
-                    counter += 1 # Incrementing counter
-            label = new_label
-            if label == 0: # If label is zero, the round is over.
+        self.suitable_ans = [] # Temporary solution, the successor of every city ([] while there is none)
+        self.shared_val = None # Temporary value shared by all worker processes (multiprocessing.Value), None when searching alone
+        self.running_tasks = {} # Subtrees searched by worker processes: future -> (bound of the subtree's node, node budget)
+        self.bound = "reduction" # Lower bound of the relaxation problem, one of BOUNDS
+        self.stats = SearchStats() # Counters and timers of the last search
+        self.callback = None # Called as callback(event, data) during the search, None to send no events
+        self.start_time = 0.0 # perf_counter() when the search started
+        self.deadline = None # time.monotonic() at which the search stops, None for no time limit
+        self.node_limit = None # Number of checked nodes at which the search stops, None for no limit
+        self.relative_gap = None # Relative gap between the temporary value and the lower bound at which the search stops
+        self.root_bounded = False # Whether the root node of the search has been bounded, there is no lower bound before
+
+    # Set the distance matrix and what depends on it
+    def __setRouteArr(self, route_arr):
+        self.route_arr = route_arr
+        self.node_num = self.route_arr.shape[0] # the number of node
+        finite = self.route_arr[np.isfinite(self.route_arr)]
+        self.integral_costs = bool(np.all(finite == np.round(finite))) # Tour lengths are integers, bounds can be rounded up
+
+    # Return the reduced matrix of the root node. A reduced matrix is (matrix, active rows, active columns).
+    def __rootReduced(self):
+        matrix = self.route_arr.copy() # Fixed size array, rows and columns are never deleted, only deactivated
+        rows = np.ones(self.node_num, dtype=bool) # Rows (starting points) that are still active
+        cols = np.ones(self.node_num, dtype=bool) # Columns (end points) that are still active
+        route_length = self.__reduceMatrix(matrix, rows, cols)
+        return route_length, (matrix, rows, cols)
+
+    # Subtract the minimum of every active row and then every active column, and return the sum of the subtracted values
+    def __reduceMatrix(self, matrix, rows, cols):
+        if self.backend == "numba":
+            row_index, col_index = np.flatnonzero(rows), np.flatnonzero(cols)
+            row_min, col_min = np.empty(len(row_index)), np.empty(len(col_index))
+            if not compiled_reduce_matrix(matrix, row_index, col_index, row_min, col_min):
+                return math.inf
+            return float(row_min.sum() + col_min.sum())
+        index = np.ix_(np.flatnonzero(rows), np.flatnonzero(cols))
+        sub_matrix = matrix[index]
+        row_min = sub_matrix.min(axis=1, keepdims=True) # Minimum value of each row
+        if np.isinf(row_min).any(): # If a row is all inf, the city can not be left any more
+            return math.inf
+        sub_matrix -= row_min
+        col_min = sub_matrix.min(axis=0, keepdims=True) # Minimum value of each column
+        if np.isinf(col_min).any(): # If a column is all inf, the city can not be entered any more
+            return math.inf
+        sub_matrix -= col_min
+        matrix[index] = sub_matrix
+        return float(row_min.sum() + col_min.sum())
+
+    # Return the smallest pair of [index, column] values in the given reduced matrix.
+    def __minimumRoute(self, target_reduced):
+        matrix, rows, cols = target_reduced
+        row_index, col_index = np.flatnonzero(rows), np.flatnonzero(cols)
+        # The choice is made on the original distances, routes that are no longer allowed are inf in the reduced matrix
+        sub_matrix = np.where(np.isinf(matrix), math.inf, self.route_arr)[np.ix_(row_index, col_index)]
+        if sub_matrix.size == 0 or np.isinf(sub_matrix).all(): # If all elements are inf, nothing is minimal
+            return [-1, -1]
+        row, col = divmod(int(np.argmin(sub_matrix)), len(col_index)) # The first minimum in row order
+        return [int(row_index[row]), int(col_index[col])]
+
+    # Given the parent node and the branch of the child, return the child node
+    # A node is [branch, reduced matrix, lower bound, reduction part of the bound, Lagrange multipliers]
+    # A branch is (route, branch of the parent, depth), a route is (i, j, status) with status 0 if the route from i to j
+    # is adopted and 1 if it is excluded. The root branch is None, so every node only adds one route to its parent's chain.
+    # The reduced matrix (n x n, with its row and column masks) is still kept by every open node, so an open node takes
+    # O(n^2) memory: rebuilding it from the root when the node is popped would redo one reduction per route of the branch.
+    def __calcSuitableSum(self, branch, parent_node):
+        matrix, rows, cols = parent_node[1] # The already reduced matrix of the parent
+        matrix, rows, cols = matrix.copy(), rows.copy(), cols.copy()
+        route_length = parent_node[3] # Start from the reduction of the parent
+        route = branch[0] # Only the last route differs from the parent
+        if route[2] == 0: # When you select this route
+            route_length += matrix[route[0], route[1]] # Add the reduced path length
+            # The route joins the path ending at route[0] and the path starting at route[1]. Going from the end of the
+            # joined path back to its start would close a subtour, so that route is inf (2->1 when 1->2 is the simplest case)
+            path_start, path_end = self.__pathEnds(parent_node[0], route[0], route[1])
+            matrix[path_end, path_start] = math.inf
+            rows[route[0]] = False # Deactivate the row of the corresponding route
+            cols[route[1]] = False # Deactivate the column of the corresponding route
+        else: # When this route is not selected
+            matrix[route[0], route[1]] = math.inf # Since we are not going to adopt it, we will use inf for the corresponding route.
+        route_length += self.__reduceMatrix(matrix, rows, cols) # Only the rows and columns touched by the route can still be reduced
+        return self.__boundNode(branch, (matrix, rows, cols), route_length, parent_node[4], self.LAGRANGIAN_NODE_ITERATIONS)
+
+    # Return the node with its lower bound: the reduction, or the better of the reduction and the 1-tree bound
+    def __boundNode(self, branch, target_reduced, reduced_length, multipliers, iterations):
+        route_length = reduced_length
+        if self.bound != "reduction" and route_length < self.__incumbentVal():
+            tree_length, multipliers = self.__treeBound(branch, target_reduced, multipliers, iterations)
+            route_length = max(route_length, tree_length)
+        return [branch, target_reduced, route_length, reduced_length, multipliers]
+
+    # Return the successor and predecessor arrays of the routes adopted on a branch (-1 where there is none)
+    def __adoptedRoutes(self, branch):
+        successors, predecessors = [-1] * self.node_num, [-1] * self.node_num
+        while branch is not None: # Follow the parent pointers up to the root
+            route, branch = branch[0], branch[1]
+            if route[2] == 0:
+                successors[route[0]], predecessors[route[1]] = route[1], route[0]
+        return successors, predecessors
+
+    # Return the first city of the adopted path that ends at city i and the last city of the one that starts at city j
+    def __pathEnds(self, branch, i, j):
+        successors, predecessors = self.__adoptedRoutes(branch)
+        while predecessors[i] != -1:
+            i = predecessors[i]
+        while successors[j] != -1:
+            j = successors[j]
+        return i, j
+
+    # Return the depth of a branch, the number of routes decided on it
+    def __depth(self, branch):
+        return 0 if branch is None else branch[2]
+
+    # Return the undirected distances of the routes still allowed at a node (inf if neither direction is allowed),
+    # and the routes forced by adopted routes. An adopted route keeps its own distance.
+    def __undirectedMatrix(self, branch, target_reduced):
+        matrix, rows, cols = target_reduced
+        allowed = rows[:, None] & cols[None, :] & np.isfinite(matrix) # Routes that can still be adopted
+        directed = np.where(allowed, self.route_arr, math.inf)
+        forced = np.zeros((self.node_num, self.node_num), dtype=bool)
+        successors = np.array(self.__adoptedRoutes(branch)[0])
+        start = np.flatnonzero(successors != -1)
+        end = successors[start]
+        directed[start, end] = self.route_arr[start, end]
+        weight = np.minimum(directed, directed.T) # A tour may use the cheaper allowed direction
+        weight[start, end] = weight[end, start] = self.route_arr[start, end]
+        forced[start, end] = forced[end, start] = True
+        return weight, forced
+
+    # Return the length of the minimum 1-tree (a spanning tree of cities 1..n-1 plus the two shortest routes at city 0)
+    # that contains every forced route, and the degree of every city in it. The length is inf if there is none.
+    def __oneTree(self, weight, forced):
+        key_weight = np.where(forced, -math.inf, weight) # Forced routes are always taken first
+        degree = np.zeros(self.node_num, dtype=int)
+        in_tree = np.zeros(self.node_num, dtype=bool)
+        in_tree[0] = True # City 0 is left out of the spanning tree
+        in_tree[1] = True
+        best_key, best_from = key_weight[1].copy(), np.ones(self.node_num, dtype=int)
+        tree_length, forced_count = 0.0, 0
+        for _ in range(self.node_num - 2): # Prim's algorithm
+            city = int(np.argmin(np.where(in_tree, math.inf, best_key)))
+            if best_key[city] == math.inf: # Some city can not be reached
+                return math.inf, degree
+            tree_length += weight[city, best_from[city]]
+            forced_count += forced[city, best_from[city]]
+            degree[city] += 1
+            degree[best_from[city]] += 1
+            in_tree[city] = True
+            closer = key_weight[city] < best_key
+            best_key[closer], best_from[closer] = key_weight[city][closer], city
+        if forced_count != forced[1:, 1:].sum() // 2: # The forced routes close a circuit among themselves
+            return math.inf, degree
+        ends = np.argsort(key_weight[0, 1:], kind="stable")[:2] + 1 # The two shortest routes at city 0, forced ones first
+        if forced[0].sum() > 2 or np.isinf(weight[0, ends]).any():
+            return math.inf, degree
+        degree[0] = 2
+        degree[ends] += 1
+        return tree_length + weight[0, ends].sum(), degree
+
+    # Return a 1-tree lower bound of a node and the Lagrange multipliers (one per city) it used.
+    # The multipliers are added to every route at their cities and improved by subgradient steps towards degree 2,
+    # starting from the parent's multipliers. With the "1-tree" bound a single 1-tree without multipliers is used.
+    def __treeBound(self, branch, target_reduced, multipliers, iterations):
+        weight, forced = self.__undirectedMatrix(branch, target_reduced)
+        if self.bound == "1-tree" or multipliers is None:
+            multipliers = np.zeros(self.node_num)
+        if self.bound == "1-tree":
+            iterations = 1
+        suitable_val = self.__incumbentVal()
+        best_length, best_multipliers = -math.inf, multipliers
+        scale = 2.0 # Step scale, halved whenever the bound stops improving
+        for _ in range(iterations):
+            tree_length, degree = self.__oneTree(weight + multipliers[:, None] + multipliers[None, :], forced)
+            if tree_length == math.inf: # No tour at this node
+                return math.inf, multipliers
+            route_length = tree_length - 2 * multipliers.sum()
+            if route_length > best_length:
+                best_length, best_multipliers = route_length, multipliers
+            else:
+                scale /= 2
+            subgradient = degree - 2
+            if not subgradient.any() or best_length >= suitable_val: # The 1-tree is a tour, or the node is pruned anyway
                 break
-        if counter == self.node_num: # If the number of moves is equal to the number of nodes, then the circuit is closed.
-            return True
-        else:
-            return False
+            gap = suitable_val - route_length if suitable_val != math.inf else abs(route_length) * 0.01 + 1
+            multipliers = multipliers + scale * gap / (subgradient @ subgradient) * subgradient
+        if self.integral_costs: # The length of a tour is an integer, so is the bound
+            best_length = math.ceil(best_length - 1e-9)
+        return best_length, best_multipliers
 
-    # Add a new route to the route to a node and add it to present_nodes
-    def __setPresentNodes(self, target_route, target_branch):
+    # Check for a closed circuit: following the successors from city 0 visits every city before coming back
+    def __checkClosedCircle(self, successors):
+        city, counter = 0, 0 # city is the current position, counter is the number of moves
+        while counter < self.node_num:
+            city = successors[city]
+            counter += 1
+            if city <= 0: # Back at city 0, or a city without successor
+                break
+        return city == 0 and counter == self.node_num
+
+    # Close a 2x2 node in both possible ways, return the length and successor array of the best closed circuit
+    def __closeRoute(self, branch, target_reduced):
+        matrix, rows, cols = target_reduced
+        (row_0, row_1), (col_0, col_1) = np.flatnonzero(rows).tolist(), np.flatnonzero(cols).tolist()
+        successors = self.__adoptedRoutes(branch)[0]
+        best_length, best_successors = math.inf, None
+        for last_routes in (((row_0, col_0), (row_1, col_1)), ((row_0, col_1), (row_1, col_0))):
+            if any(math.isinf(matrix[route[0], route[1]]) for route in last_routes): # Route not allowed any more
+                continue
+            closed_successors = list(successors)
+            for route in last_routes:
+                closed_successors[route[0]] = route[1]
+            if self.__checkClosedCircle(closed_successors): # Is it a closed circuit?
+                route_length = float(self.route_arr[np.arange(self.node_num), closed_successors].sum())
+                if best_length > route_length:
+                    best_length, best_successors = route_length, closed_successors
+        return best_length, best_successors
+
+    # Add the two children of a node, which adopt or exclude target_route, to present_nodes
+    def __setPresentNodes(self, target_route, target_node):
+        depth = self.__depth(target_node[0]) + 1
         for status in range(2):
-            target_route_tmp = copy.deepcopy(target_route) # Copy target_route
-            target_route_tmp.append(status) # Add status (adoption status).
-            target_branch_tmp = copy.deepcopy(target_branch) # Copy target_branch
-            target_branch_tmp.append(target_route_tmp) # Add route
-            self.present_nodes.append(target_branch_tmp) # Add to present_nodes
+            branch = ((target_route[0], target_route[1], status), target_node[0], depth) # Points to the branch of the parent
+            self.present_nodes.append([branch, target_node]) # Add to present_nodes with its parent
 
     #Evaluate the corresponding node, if branching is possible, evaluate the node, if branching is finished, compare with provisional value
     def __evaluateNode(self, target_node):
-        if (False if target_node[1].shape == (2, 2) else True):  # When we can still branch. Condition is that the DataFrame of target_node has reached 2x2.
-            next_route = self.__minimumRoute(target_node[1]) # Get the minimum value [index, column]
+        if self.callback is not None:
+            self.callback("node_expanded", {"bound": float(target_node[2]), "depth": self.__depth(target_node[0])})
+        if target_node[1][1].sum() > 2: # When we can still branch. Condition is that the reduced matrix of target_node has reached 2x2.
+            next_route = self.__timed("branching", self.__minimumRoute, target_node[1]) # Get the minimum value [index, column]
             if next_route != [-1, -1]: # If [-1, -1], the distance will be inf, so not suitable, do not add anything to present_nodes
-                self.__setPresentNodes(next_route, target_node[0])
+                self.__setPresentNodes(next_route, target_node)
         else: # At the end of the branch
-            if self.__checkClosedCircle(target_node[0], target_node[1]): # Is it a closed circuit?
-                if self.suitable_val > target_node[2]: # Less than the provisional value?
-                    self.suitable_val = target_node[2] # Update the temporary value
-                    self.suitable_ans = target_node[0] # Update the temporary solution
-
-    # Converting a list of routes into a path
-    def __displayRoutePath(self, route_list):
-        label, counter, route_path = 0, 0, "0" # label is the current position, counter is the number of moves, and route_path is the route.
-        for i in range(self.node_num): # The maximum number of iterations is the number of nodes
-            for route in route_list:
-                if route[0] == label and route[2] == 0: # If the starting point is label and it is an adopted path, then
-                    new_label = route[1] # Update the label
-                    route_path += " -> " + str(new_label)
-                    counter += 1 # Incrementing counter
-            label = new_label
-            if label == 0: # If label is zero, the round is over.
-                break
-        return route_path
+            route_length, successors = self.__timed("closing", self.__closeRoute, target_node[0], target_node[1])
+            self.__updateIncumbent(route_length, successors)
 
-    # Compute the optimal value and optimal solution (main method)
-    def getSuitableAns(self):
-        target_route = self.__minimumRoute(self.route_df) # Get the minimum element of the route's DataFrame.
-        self.__setPresentNodes(target_route, []) # Set to present_nodes
+    # Converting a successor array into a path
+    def __displayRoutePath(self, successors):
+        if len(successors) == 0: # No closed circuit
+            return "0"
+        return " -> ".join(map(str, self.__successorsToTour(successors) + [0]))
 
-        while True:
-            if self.suitable_val != math.inf: # When the tentative value of the optimal solution is set
-                self.stack_search_nodes = list(filter(lambda node: node[2] < self.suitable_val, self.stack_search_nodes)) # Exclude if the solution to the relaxation problem for the stacked nodes exceeds the provisional value.
+    # Return the distance matrix used by the heuristics, inf is replaced by a large finite penalty so that differences stay defined
+    def __heuristicMatrix(self):
+        finite = np.isfinite(self.route_arr)
+        penalty = (self.route_arr[finite].max() + 1) * self.node_num if finite.any() else 1.0
+        return np.where(finite, self.route_arr, penalty)
+
+    # Build a tour (array of cities) by always moving to the nearest unvisited city, starting at city 0
+    def __nearestNeighbour(self, matrix):
+        tour = np.zeros(self.node_num, dtype=int)
+        visited = np.zeros(self.node_num, dtype=bool)
+        visited[0] = True
+        for k in range(1, self.node_num):
+            tour[k] = np.argmin(np.where(visited, math.inf, matrix[tour[k - 1]])) # Nearest city not visited yet
+            visited[tour[k]] = True
+        return tour
+
+    # Apply the best 2-opt move (reverse tour[i+1..j]) to the tour, return whether the tour improved
+    def __twoOptMove(self, matrix, tour):
+        next_tour = np.roll(tour, -1)
+        forward = np.concatenate(([0], np.cumsum(matrix[tour, next_tour])[:-1])) # Length along the tour up to each position
+        backward = np.concatenate(([0], np.cumsum(matrix[next_tour, tour])[:-1])) # Same, but walking every route in reverse
+        i, j = np.triu_indices(self.node_num, k=1)
+        a, b, c, d = tour[i], tour[(i + 1) % self.node_num], tour[j], tour[(j + 1) % self.node_num]
+        delta = matrix[a, c] + matrix[b, d] - matrix[a, b] - matrix[c, d] \
+            + (backward[j] - backward[i + 1]) - (forward[j] - forward[i + 1]) # The reversed segment changes direction (asymmetric case)
+        best = int(np.argmin(delta))
+        if delta[best] >= -1e-9: # No improving move
+            return False
+        tour[i[best] + 1:j[best] + 1] = tour[i[best] + 1:j[best] + 1][::-1].copy()
+        return True
+
+    # Apply the best Or-opt move (move 1 to 3 consecutive cities elsewhere, possibly reversed), return whether the tour improved
+    def __orOptMove(self, matrix, tour):
+        best_delta, best_tour = -1e-9, None
+        for length in range(1, min(3, self.node_num - 2) + 1):
+            for start in range(self.node_num - length + 1):
+                end = start + length - 1
+                segment = tour[start:end + 1]
+                rest = np.concatenate((tour[end + 1:], tour[:start])) # The rest of the tour, from the city after the segment to the one before
+                prev_city, next_city = rest[-1], rest[0]
+                inner_forward = matrix[segment[:-1], segment[1:]].sum()
+                inner_backward = matrix[segment[1:], segment[:-1]].sum()
+                remove = matrix[prev_city, next_city] - matrix[prev_city, segment[0]] - matrix[segment[-1], next_city]
+                rest_next = np.roll(rest, -1)
+                base = remove - matrix[rest, rest_next] # Insert between rest[k] and rest[k+1]
+                insert_forward = base + matrix[rest, segment[0]] + matrix[segment[-1], rest_next]
+                insert_backward = base + matrix[rest, segment[-1]] + matrix[segment[0], rest_next] + inner_backward - inner_forward
+                for insert, reverse in ((insert_forward, False), (insert_backward, True)):
+                    k = int(np.argmin(insert))
+                    if insert[k] < best_delta:
+                        best_delta = insert[k]
+                        best_tour = np.concatenate((rest[:k + 1], segment[::-1] if reverse else segment, rest[k + 1:]))
+        if best_tour is None: # No improving move
+            return False
+        tour[:] = best_tour
+        return True
+
+    # Improve the tour with 2-opt and Or-opt moves until neither of them finds an improvement
+    def __localSearch(self, matrix, tour):
+        if self.node_num < 3:
+            return tour
+        while self.__twoOptMove(matrix, tour) or self.__orOptMove(matrix, tour):
+            pass
+        return np.roll(tour, -int(np.flatnonzero(tour == 0)[0])) # Start the tour at city 0 again
+
+    # Converting a tour into a successor array
+    def __tourToSuccessors(self, tour):
+        successors = [0] * self.node_num
+        for city, next_city in zip(tour.tolist(), np.roll(tour, -1).tolist()):
+            successors[city] = next_city
+        return successors
+
+    # Compute a good closed circuit quickly (nearest neighbour, then 2-opt and Or-opt), and use it as the temporary value
+    def getHeuristicAns(self):
+        matrix = self.__heuristicMatrix()
+        tour = self.__localSearch(matrix, self.__nearestNeighbour(matrix))
+        successors = self.__tourToSuccessors(tour)
+        route_length = float(self.route_arr[tour, np.roll(tour, -1)].sum()) # inf if the tour needed a route that does not exist
+        self.__updateIncumbent(route_length, successors)
+        return route_length, self.__displayRoutePath(successors)
+
+    # Converting a successor array into a tour (list of cities starting at city 0)
+    def __successorsToTour(self, successors):
+        tour = [0]
+        while len(tour) < len(successors):
+            tour.append(successors[tour[-1]])
+        return tour
 
+    # Return the tour of the cheapest way to insert city between two consecutive cities of tour
+    def __insertCity(self, matrix, tour, city):
+        tour = np.asarray(tour)
+        next_tour = np.roll(tour, -1)
+        position = int(np.argmin(matrix[tour, city] + matrix[city, next_tour] - matrix[tour, next_tour]))
+        return np.insert(tour, position + 1, city)
+
+    # Re-solve after small edits of the instance (a Delta of TSP_instance.py), starting from the previous closed circuit:
+    # it is renumbered, an added city is inserted where it costs least and 2-opt and Or-opt repair it around the edits.
+    # The repaired circuit is the temporary value of the new search, which needs no warm start heuristic from scratch.
+    # previous_tour is a list of cities or a path as returned by getSuitableAns, by default the temporary solution of
+    # this TSP. The other arguments are those of getSuitableAns, the repair is part of the search (events, stats, limits).
+    def updateSuitableAns(self, delta, previous_tour=None, strategy="dive", workers=1, bound="reduction", callback=None,
+                          timing=False, time_limit=None, node_limit=None, relative_gap=None):
+        if previous_tour is None:
+            previous_tour = self.__successorsToTour(self.suitable_ans) if len(self.suitable_ans) else []
+        elif isinstance(previous_tour, str):
+            previous_tour = [int(city) for city in previous_tour.split("->")]
+        if len(previous_tour) > 1 and previous_tour[0] == previous_tour[-1]: # Closed as 0 -> ... -> 0
+            previous_tour = previous_tour[:-1]
+        self.__setRouteArr(delta.apply(self.route_arr))
+        self.suitable_val, self.suitable_ans = math.inf, []
+        self.__newSearch(strategy, bound, callback, timing, time_limit, node_limit, relative_gap)
+        tour = delta.renumber(previous_tour)
+        if len(tour) != self.node_num - (delta.add_city is not None): # No usable previous closed circuit
+            return self.__searchFromRoot(True, workers)
+        self.__timed("heuristic", self.__repairTour, tour, delta.add_city is not None)
+        return self.__searchFromRoot(False, workers)
+
+    # Insert the added city (the last one) into tour when added is set, improve it and use it as the temporary value
+    def __repairTour(self, tour, added):
+        matrix = self.__heuristicMatrix()
+        if added:
+            tour = self.__insertCity(matrix, tour, self.node_num - 1)
+        tour = self.__localSearch(matrix, np.array(tour))
+        self.__updateIncumbent(float(self.route_arr[tour, np.roll(tour, -1)].sum()), self.__tourToSuccessors(tour))
+
+    # Return the temporary value to prune with, the best one found by any process when searching in parallel
+    def __incumbentVal(self):
+        if self.shared_val is None:
+            return self.suitable_val
+        return min(self.suitable_val, self.shared_val.value)
+
+    # Update the temporary value and solution if the closed circuit is shorter than every one found so far
+    def __updateIncumbent(self, route_length, successors):
+        if self.__incumbentVal() > route_length: # Less than the provisional value?
+            self.suitable_val = route_length # Update the temporary value
+            self.suitable_ans = successors # Update the temporary solution
+            self.stats.incumbent_updates += 1
+            if self.shared_val is not None: # Let the other processes prune with it
+                with self.shared_val.get_lock():
+                    self.shared_val.value = min(self.shared_val.value, route_length)
+            if self.callback is not None:
+                self.callback("incumbent_improved", {"value": float(route_length)})
+                if self.root_bounded: # A warm start comes before the root, the open nodes do not bound anything yet
+                    self.__emitBoundGap()
+
+    # Return the smallest relaxation of the open nodes, a lower bound of every closed circuit not found yet
+    def __lowerBound(self):
+        open_bounds = [node[2] for key, count, node in self.stack_search_nodes]
+        open_bounds += [parent_node[2] for branch, parent_node in self.present_nodes] # Children are at least their parent
+        open_bounds += [bound for bound, budget in self.running_tasks.values()] # Nodes being searched by worker processes
+        return min(min(open_bounds, default=math.inf), self.__incumbentVal())
+
+    # Send the current lower bound, temporary value and relative gap between them to the callback
+    def __emitBoundGap(self):
+        lower_bound, suitable_val = float(self.__lowerBound()), float(self.__incumbentVal())
+        gap = (suitable_val - lower_bound) / abs(suitable_val) if 0 < abs(suitable_val) < math.inf else math.inf
+        self.callback("bound_gap", {"lower_bound": lower_bound, "suitable_val": suitable_val, "gap": gap})
+
+    # Call function(*args), adding the time it takes to the phase when the search is timed
+    def __timed(self, phase, function, *args):
+        if not self.stats.timing:
+            return function(*args)
+        start_time = time.perf_counter()
+        result = function(*args)
+        self.stats.phase_times[phase] += time.perf_counter() - start_time
+        return result
+
+    # Count a node dropped by pruning
+    def __pruned(self, target_node):
+        self.stats.nodes_pruned += 1
+        if self.callback is not None:
+            self.callback("node_pruned", {"bound": float(target_node[2]), "depth": self.__depth(target_node[0])})
+
+    # Return the heap key of a node, the smallest key is checked first
+    def __nodeKey(self, target_node):
+        remaining = int(target_node[1][1].sum()) # Size of the reduced matrix, it shrinks by one with every adopted route
+        if self.diving:
+            return (remaining, target_node[2]) # Deepest node first, smallest relaxation on ties
+        return (target_node[2], remaining) # Smallest relaxation first, deeper node on ties
+
+    # Stack a node on the heap
+    def __pushNode(self, target_node):
+        heapq.heappush(self.stack_search_nodes, (self.__nodeKey(target_node), next(self.stack_counter), target_node))
+
+    # Pop the next node to check, nodes that can not beat the provisional value are dropped here (lazy pruning)
+    def __popNode(self):
+        suitable_val = self.__incumbentVal()
+        if self.strategy == "dive" and self.diving and suitable_val != math.inf:
+            # The first closed circuit has been found, switch the heap from depth-first to best-first
+            self.diving = False
+            self.stack_search_nodes = [(self.__nodeKey(node), count, node) for key, count, node in self.stack_search_nodes]
+            heapq.heapify(self.stack_search_nodes)
+        while len(self.stack_search_nodes) != 0:
+            target_node = heapq.heappop(self.stack_search_nodes)[2]
+            if target_node[2] < suitable_val: # Exclude if the solution to the relaxation problem exceeds the provisional value.
+                return target_node
+            self.__pruned(target_node)
+        return None
+
+    # Return whether the time, node or gap limit of the search is reached, and record which one in stats.status.
+    # The gap needs the lower bound of all open nodes, so it is only checked when check_gap is set.
+    def __limitReached(self, check_gap):
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.stats.status = "time_limit"
+        elif self.node_limit is not None and self.stats.nodes_checked >= self.node_limit:
+            self.stats.status = "node_limit"
+        elif self.relative_gap is not None and check_gap and self.__incumbentVal() != math.inf \
+                and self.__incumbentVal() - self.__lowerBound() <= self.relative_gap * abs(self.__incumbentVal()):
+            self.stats.status = "gap_limit"
+        else:
+            return False
+        return True
+
+    # Check stacked nodes until the stack runs out, node_limit nodes have been checked, open_limit nodes are stacked
+    # or a limit of the search is reached
+    def __search(self, node_limit=math.inf, open_limit=math.inf):
+        checked = 0
+        while True:
             while len(self.present_nodes) != 0: # If there is a list of search, then we ask for a solution to the relaxation problem and stack
-                first_list = self.present_nodes[0] # Get present_nodes to evaluate
-                self.present_nodes.pop(0) # Evaluate, so exclude from present_nodes
-                route_length, next_route = self.__calcSuitableSum(first_list) # Get the solution to the relaxation problem
-                self.stack_search_nodes.insert(0, [first_list, next_route, route_length]) # stack
-
-            if len(self.stack_search_nodes) == 0: # When the stack runs out, it's done.
-                break;
-
-            # When the number of stacked nodes is one, or when the solution of the first relaxation problem of a stacked node is smaller than the solution of the second relaxation problem (in order to check the best solution first)
-            if len(self.stack_search_nodes) == 1 or self.stack_search_nodes[0][2] <= self.stack_search_nodes[1][2]:
-                self.__evaluateNode(self.stack_search_nodes[0]) # Evaluate the first node
-                self.stack_search_nodes.pop(0) # Delete the first node
-            else:
-                self.__evaluateNode(self.stack_search_nodes[1]) # Evaluate the second node
-                self.stack_search_nodes.pop(1) # Delete the second node
+                branch, parent_node = self.present_nodes.pop() # Get present_nodes to evaluate
+                next_node = self.__timed("bounding", self.__calcSuitableSum, branch, parent_node) # Get the solution to the relaxation problem
+                if next_node[2] < self.__incumbentVal(): # A node whose relaxation is not below the provisional value can not improve it
+                    self.__pushNode(next_node) # stack
+                    self.stats.nodes_stacked += 1
+                else:
+                    self.__pruned(next_node)
+
+            if checked >= node_limit or len(self.stack_search_nodes) >= open_limit:
+                break
+            if self.__limitReached(self.stats.nodes_checked % self.GAP_EVENT_NODES == 0):
+                break
+            target_node = self.__popNode() # Take the node to check next according to the strategy
+            if target_node is None: # When the stack runs out, it's done.
+                break
+            self.__evaluateNode(target_node)
+            checked += 1
+            self.stats.nodes_checked += 1
+            if self.callback is not None and self.stats.nodes_checked % self.GAP_EVENT_NODES == 0:
+                self.__emitBoundGap()
+
+    # Search the subtree under target_node in a worker process, at most node_limit nodes and until the deadline.
+    # Return the best closed circuit found here (math.inf and [] if none), the nodes still open and the stats of the search.
+    def _searchSubtree(self, target_node, strategy, bound, timing, node_limit, deadline):
+        self.strategy, self.diving, self.bound = strategy, strategy != "best", bound
+        self.suitable_val, self.suitable_ans = math.inf, []
+        self.stack_search_nodes, self.stats = [], SearchStats(timing)
+        self.deadline = deadline
+        self.__pushNode(target_node)
+        self.__search(node_limit)
+        open_nodes = [node for key, count, node in self.stack_search_nodes if node[2] < self.__incumbentVal()]
+        self.stats.nodes_pruned += len(self.stack_search_nodes) - len(open_nodes)
+        return self.suitable_val, self.suitable_ans, open_nodes, self.stats
+
+    # Return the number of nodes the next worker task may check: TASK_NODES, or less when the rest of the node limit
+    # (minus the budgets of the running tasks) is smaller
+    def __taskBudget(self):
+        if self.node_limit is None:
+            return self.TASK_NODES
+        handed_out = sum(budget for bound, budget in self.running_tasks.values())
+        return min(self.TASK_NODES, self.node_limit - self.stats.nodes_checked - handed_out)
 
+    # Distribute the stacked nodes over worker processes. Each worker checks TASK_NODES nodes of its subtree and
+    # returns the nodes still open, which go back to the stack so that idle workers pick them up.
+    # When a limit is reached no more subtrees are handed out, and the open nodes of the running ones are collected.
+    # The node limit is shared out between the tasks, a new task is only started while some of it is left.
+    def __parallelSearch(self, workers):
+        self.shared_val = multiprocessing.Value("d", self.suitable_val)
+        self.__search(open_limit=workers * 4) # Branch here first so that every worker gets a subtree
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(self.route_arr, self.shared_val, self.backend)) as executor:
+            while self.stats.status == "complete" or len(self.running_tasks) != 0:
+                while self.stats.status == "complete" and len(self.running_tasks) < workers and not self.__limitReached(True):
+                    budget = self.__taskBudget()
+                    if budget <= 0: # The rest of the node limit is already handed out
+                        break
+                    target_node = self.__popNode()
+                    if target_node is None:
+                        break
+                    future = executor.submit(_search_subtree, target_node, self.strategy, self.bound, self.stats.timing, budget, self.deadline)
+                    self.running_tasks[future] = (target_node[2], budget)
+                if len(self.running_tasks) == 0: # Nothing open and no worker busy, it's done.
+                    break
+                done = wait(list(self.running_tasks), return_when=FIRST_COMPLETED)[0]
+                for future in done:
+                    route_length, successors, open_nodes, stats = future.result()
+                    self.stats.merge(stats)
+                    if self.suitable_val > route_length: # The shared value is already set, keep the solution that goes with it
+                        self.suitable_val, self.suitable_ans = route_length, successors
+                        if self.callback is not None:
+                            self.callback("incumbent_improved", {"value": float(route_length)})
+                            self.__emitBoundGap()
+                    for node in open_nodes:
+                        self.__pushNode(node)
+                    del self.running_tasks[future] # Its open nodes are on the heap now
+        self.shared_val = None
+
+    # Set up the callback, stats and limits of a search. time_limit is in seconds, node_limit counts checked nodes and
+    # relative_gap stops once (temporary value - lower bound) / temporary value is at most that value.
+    def __startSearch(self, callback, timing, time_limit, node_limit, relative_gap):
+        self.callback = callback
+        self.stats = SearchStats(timing or callback is not None)
+        self.start_time = time.perf_counter()
+        self.deadline = None if time_limit is None else time.monotonic() + time_limit
+        self.node_limit, self.relative_gap = node_limit, relative_gap
+
+    # Search the open nodes and return the temporary value and solution
+    def __finishSearch(self, workers):
+        if workers > 1:
+            self.__parallelSearch(workers)
+        else:
+            self.__search()
+        self.stats.suitable_val = self.suitable_val
+        self.stats.lower_bound = self.__lowerBound()
+        self.stats.elapsed = time.perf_counter() - self.start_time
+        if self.callback is not None:
+            self.__emitBoundGap()
         return self.suitable_val, self.__displayRoutePath(self.suitable_ans) # Return optimal value, optimal path
 
-# Route List ( c_ij : distance between city i and j )
-C = [
-        [math.inf, 30, 30, 25, 10],
-        [30, math.inf, 30, 45, 20],
-        [30, 30, math.inf, 25, 20],
-        [25, 45, 25, math.inf, 30],
-        [10, 20, 20, 30, math.inf]
-    ]
-# Instantiate and use methods
-salesman = TSP(C)
-suitable_val, suitable_route = salesman.getSuitableAns()
-print(suitable_val)
-print(suitable_route)
\ No newline at end of file
+    # Compute the optimal value and optimal solution (main method)
+    # strategy selects the order in which stacked nodes are checked, see SEARCH_STRATEGIES
+    # warm_start computes a heuristic closed circuit first so that nodes are pruned from the beginning
+    # workers > 1 searches with that many processes, which share the temporary value
+    # bound selects the lower bound of every node, see BOUNDS. The 1-tree bounds cost more per node but prune far more.
+    # callback(event, data) is called on "node_expanded", "node_pruned", "incumbent_improved" and "bound_gap" events,
+    # timing measures the time of every phase in stats.phase_times (always on with a callback). Both are off by default.
+    # With workers > 1, node events are only sent for the nodes the main process checks.
+    # time_limit (seconds), node_limit and relative_gap stop the search early: the best closed circuit found is returned,
+    # stats.status tells which limit was hit and stats.lower_bound is the lower bound of the optimal value.
+    # The open nodes are kept, continueSuitableAns or a checkpoint (saveCheckpoint) can go on from them.
+    def getSuitableAns(self, strategy="dive", warm_start=True, workers=1, bound="reduction", callback=None, timing=False,
+                       time_limit=None, node_limit=None, relative_gap=None):
+        self.__newSearch(strategy, bound, callback, timing, time_limit, node_limit, relative_gap)
+        return self.__searchFromRoot(warm_start, workers)
+
+    # Set up a search from the root: settings, no open nodes, callback, stats and limits (see getSuitableAns)
+    def __newSearch(self, strategy, bound, callback, timing, time_limit, node_limit, relative_gap):
+        if strategy not in self.SEARCH_STRATEGIES:
+            raise ValueError("unknown strategy: {}, expected one of {}".format(strategy, self.SEARCH_STRATEGIES))
+        if bound not in self.BOUNDS:
+            raise ValueError("unknown bound: {}, expected one of {}".format(bound, self.BOUNDS))
+        self.strategy = strategy
+        self.diving = strategy != "best"
+        self.bound = bound
+        self.stack_search_nodes, self.present_nodes = [], []
+        self.root_bounded = False
+        self.__startSearch(callback, timing, time_limit, node_limit, relative_gap)
+
+    # Bound the root node and search from it, after the warm start heuristic when warm_start is set
+    def __searchFromRoot(self, warm_start, workers):
+        if warm_start:
+            self.__timed("heuristic", self.getHeuristicAns) # Set the temporary value and solution
+        route_length, root_reduced = self.__rootReduced() # Reduce the whole matrix once
+        root_node = self.__timed("bounding", self.__boundNode, None, root_reduced, route_length, None, self.LAGRANGIAN_ROOT_ITERATIONS)
+        self.root_bounded = True
+        if self.node_num == 2: # Already a 2x2 matrix, there is nothing to branch
+            self.__evaluateNode(root_node)
+        elif root_node[2] < self.suitable_val:
+            target_route = self.__minimumRoute(root_reduced) # Get the minimum element of the matrix.
+            self.__setPresentNodes(target_route, root_node) # Set to present_nodes
+        return self.__finishSearch(workers)
+
+    # Continue a search stopped by a limit (or loaded with loadCheckpoint) from its open nodes, with new limits
+    def continueSuitableAns(self, workers=1, callback=None, timing=False, time_limit=None, node_limit=None, relative_gap=None):
+        self.__startSearch(callback, timing, time_limit, node_limit, relative_gap)
+        return self.__finishSearch(workers)
+
+    # Save the open nodes, the temporary value and solution and the search settings to a file
+    def saveCheckpoint(self, path):
+        checkpoint = {"route_arr": self.route_arr, "open_nodes": [node for key, count, node in self.stack_search_nodes],
+                      "present_nodes": self.present_nodes, "suitable_val": self.suitable_val, "suitable_ans": self.suitable_ans,
+                      "strategy": self.strategy, "diving": self.diving, "bound": self.bound}
+        with open(path, "wb") as f:
+            pickle.dump(checkpoint, f)
+
+    # Return a TSP restored from a file written by saveCheckpoint, ready for continueSuitableAns
+    @classmethod
+    def loadCheckpoint(cls, path, backend="auto"):
+        with open(path, "rb") as f:
+            checkpoint = pickle.load(f)
+        salesman = cls(checkpoint["route_arr"], backend)
+        salesman.strategy, salesman.diving, salesman.bound = checkpoint["strategy"], checkpoint["diving"], checkpoint["bound"]
+        salesman.suitable_val, salesman.suitable_ans = checkpoint["suitable_val"], checkpoint["suitable_ans"]
+        salesman.present_nodes = checkpoint["present_nodes"]
+        salesman.root_bounded = True
+        for node in checkpoint["open_nodes"]:
+            salesman.__pushNode(node)
+        return salesman
+
+# The TSP of a worker process, it only keeps the distance matrix between tasks
+_worker_tsp = None
+
+# Set up a worker process of the parallel search
+def _init_worker(route_arr, shared_val, backend):
+    global _worker_tsp
+    _worker_tsp = TSP(route_arr, backend)
+    _worker_tsp.shared_val = shared_val
+
+# Search one subtree in a worker process
+def _search_subtree(target_node, strategy, bound, timing, node_limit, deadline):
+    return _worker_tsp._searchSubtree(target_node, strategy, bound, timing, node_limit, deadline)
+
+if __name__ == "__main__":
+    # Route List ( c_ij : distance between city i and j )
+    C = [
+            [math.inf, 30, 30, 25, 10],
+            [30, math.inf, 30, 45, 20],
+            [30, 30, math.inf, 25, 20],
+            [25, 45, 25, math.inf, 30],
+            [10, 20, 20, 30, math.inf]
+        ]
+    # Instantiate and use methods
+    salesman = TSP(C)
+    suitable_val, suitable_route = salesman.getSuitableAns()
+    print(suitable_val)
+    print(suitable_route)
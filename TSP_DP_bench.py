@@ -0,0 +1,34 @@
+import argparse
+import os
+import time
+from TSP_DP_en import held_karp
+from TSP_bench import euclidean_instance
+from TSP_kernels import BACKENDS
+
+# Time held_karp on one instance of every size with every number of workers, and print the speedup over 1 worker
+def main():
+    parser = argparse.ArgumentParser(description="Scaling of the parallel Held-Karp layers with the number of workers")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(range(18, 25)), help="numbers of cities V")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, os.cpu_count()], help="numbers of worker processes")
+    parser.add_argument("--dtype", default="float32", help="dtype of the dp table")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", default="auto", choices=list(BACKENDS), help="code that fills the layers")
+    args = parser.parse_args()
+
+    workers_list = sorted(set(args.workers))
+    held_karp(euclidean_instance(4, args.seed), dtype=args.dtype, backend=args.backend) # Compile the Numba kernel before anything is timed
+    print("V\t" + "\t".join("{} workers".format(workers) for workers in workers_list))
+    for V in args.sizes:
+        cost = euclidean_instance(V, args.seed)
+        times, answers = [], set()
+        for workers in workers_list:
+            start_time = time.perf_counter()
+            ans, tour = held_karp(cost, dtype=args.dtype, workers=workers, backend=args.backend)
+            times.append(time.perf_counter() - start_time)
+            answers.add(ans)
+        assert len(answers) == 1, "different answers for V={}: {}".format(V, answers)
+        print("{}\t".format(V) + "\t".join("{:.2f}s (x{:.1f})".format(t, times[0] / t) for t in times))
+
+
+if __name__ == "__main__":
+    main()
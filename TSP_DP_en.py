@@ -1,39 +1,341 @@
 import math
-i = 0
-def tsp_dp(stack_search_nodes, present_node, dp, count):
-    print("cycle{}: ssn:{}, pn:{}".format(count, bin(stack_search_nodes), present_node))
-    if dp[stack_search_nodes][present_node] != -1: # If you've already visited, return the note.
-        print("already visited. return dp")
-        print(dp[stack_search_nodes][present_node])
-        return dp[stack_search_nodes][present_node]
-    if stack_search_nodes==(1<<V)-1 and present_node==0: # you've visited all nodes, and you are back at nodes 0.
-        print("have visited all nodes")
-        return 0 # We don't have to move anymore.
-
-    res = math.inf
-    for u in range(V):
-        if stack_search_nodes>>u & 1 == 0: # Unvisited or not
-            res = min(res, tsp_dp(stack_search_nodes|1<<u, u, dp, count+1) + C[present_node][u])
-            print("unvisited, so updated, res:{}, present_node:{}, u;{}, count:{}".format(res, bin(present_node), u, count))
-    dp[stack_search_nodes][present_node] = res
-    return res
-
-
-C = [
-        [math.inf, 30, 30, 25, 10],
-        [30, math.inf, 30, 45, 20],
-        [30, 30, math.inf, 25, 20],
-        [25, 45, 25, math.inf, 30],
-        [10, 20, 20, 30, math.inf]
-    ]
-
-V, E = 5, 10
-
-dp = [[-1] * V for _ in range(1<<V)] # dp[stack_search_nodes][present_node]
-
-ans = tsp_dp(0, 0, dp, 0) # Start at vertex 0. However, vertex 0 is not visited.
-if ans == math.inf:
-    print(-1)
-else:
-    print (ans)
+import os
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from TSP_instance import as_matrix
+from TSP_kernels import resolve_backend, fill_subsets as compiled_fill_subsets
 
+# Return the infinity used in a dp table of the given dtype (integer tables use a large value that can still be added to)
+def dp_inf(dtype):
+    if dtype.kind == "f":
+        return np.inf
+    return np.iinfo(dtype).max // 4
+
+# Return the cost matrix (a matrix or a DistanceProvider) in the dtype of the dp table, with inf replaced by the infinity of that dtype, and that infinity
+def prepare_cost(cost_matrix, dtype):
+    INF = dp_inf(dtype)
+    cost = as_matrix(cost_matrix)
+    return np.where(np.isfinite(cost), np.minimum(cost, INF), INF).astype(dtype), INF
+
+# Return the subsets of {0, ..., n-1} as bit masks, grouped by the number of elements: masks_by_size[k] holds the masks with k bits set
+def masks_by_size(n):
+    popcount = np.zeros(1 << n, dtype=np.int8)
+    for b in range(n):
+        popcount[1 << b:2 << b] = popcount[:1 << b] + 1 # Setting bit b adds one to every mask below it
+    masks = np.argsort(popcount, kind="stable") # Masks ordered by the number of bits, then by value
+    return np.split(masks, np.cumsum(np.bincount(popcount, minlength=n + 1))[:-1])
+
+# Return the dtype of the parent table for n nodes other than the start node
+def parent_dtype(n):
+    return np.dtype(np.int8 if n < 128 else np.int16)
+
+# Return the bytes needed by held_karp to keep the whole dp and parent tables of V nodes in memory
+def held_karp_memory(V, dtype=np.float64):
+    n = max(V - 1, 0)
+    return (1 << n) * n * (np.dtype(dtype).itemsize + parent_dtype(n).itemsize)
+
+# Return comb[b][i] = C(b, i), the number of ways to choose i of b nodes, for 0 <= b <= n and 0 <= i <= n + 1
+def comb_table(n):
+    return np.array([[math.comb(b, i) for i in range(n + 2)] for b in range(n + 1)], dtype=np.int64)
+
+# Return the subsets with k nodes whose ranks are start, ..., stop-1, as a matrix of their nodes in increasing order.
+# The rank of {b_1 < b_2 < ... < b_k} is C(b_1, 1) + C(b_2, 2) + ... + C(b_k, k) (combinatorial number system),
+# so the ranks of the subsets of one size are exactly 0, ..., C(n, k)-1.
+def unrank_subsets(comb, k, start, stop):
+    rank = np.arange(start, stop, dtype=np.int64)
+    members = np.empty((len(rank), k), dtype=np.int64)
+    for i in range(k, 0, -1):
+        members[:, i - 1] = np.searchsorted(comb[:, i], rank, side="right") - 1 # Largest b with C(b, i) <= rank
+        rank -= comb[members[:, i - 1], i]
+    return members
+
+# Return the rank of one subset given as a sorted list of nodes
+def rank_subset(comb, members):
+    return int(sum(comb[b, i + 1] for i, b in enumerate(members)))
+
+# Held-Karp that keeps only two layers (the subsets of size k-1 and k) of the dp table in memory.
+# A layer is indexed by the rank of the subset and the position of the last node v in it, so it holds C(n, k) x k cells.
+# The parents of every layer are written to numpy.memmap files under spill_dir (a temporary directory by default)
+# so the tour can still be rebuilt, and layers that do not fit in half of memory_budget (bytes) are memory-mapped as well.
+# Subsets are processed in chunks sized to the other half of the budget.
+def held_karp_layered(cost_matrix, dtype=np.float64, memory_budget=1 << 30, spill_dir=None):
+    dtype = np.dtype(dtype)
+    cost, INF = prepare_cost(cost_matrix, dtype) # c_ij: distance between node i and j
+    V = cost.shape[0]
+    if V == 1:
+        return 0, [0, 0]
+    n = V - 1 # Number of nodes other than the start node
+    comb = comb_table(n)
+
+    with tempfile.TemporaryDirectory(dir=spill_dir) as work_dir:
+        # Allocate a layer in memory, or in a file when it is too large for the budget
+        def allocate(name, shape, layer_dtype):
+            if np.prod(shape) * layer_dtype.itemsize * 2 <= memory_budget // 2:
+                return np.empty(shape, dtype=layer_dtype)
+            return np.memmap(os.path.join(work_dir, name), dtype=layer_dtype, mode="w+", shape=shape)
+
+        prev = cost[0, 1:].reshape(n, 1) # Layer 1, the subset {b} has rank b: go straight from node 0 to b
+        cur = parent = None
+        parents = [None, None] # parents[k] is the memmap of the parents of layer k
+        for k in range(2, n + 1):
+            size = int(comb[n, k])
+            cur = allocate("dp_{}.dat".format(k), (size, k), dtype)
+            parent = np.memmap(os.path.join(work_dir, "parent_{}.dat".format(k)), dtype=parent_dtype(n), mode="w+", shape=(size, k))
+            chunk = max(1, (memory_budget // 2) // (k * 64)) # About 64 bytes of working memory per cell of a chunk
+            for start in range(0, size, chunk):
+                stop = min(start + chunk, size)
+                members = unrank_subsets(comb, k, start, stop) # Nodes of each subset S in the chunk
+                rows = np.arange(stop - start)
+                head = np.cumsum(comb[members, np.arange(1, k + 1)], axis=1) # Rank terms of the nodes before a position
+                tail = np.cumsum(comb[members, np.arange(k)][:, ::-1], axis=1)[:, ::-1] # Rank terms of the nodes after it, shifted down by one
+                for p in range(k): # v is the p-th node of S
+                    v = members[:, p]
+                    rest = np.delete(members, p, axis=1) # S - {v}, still sorted
+                    prev_rank = (head[:, p - 1] if p > 0 else 0) + (tail[:, p + 1] if p + 1 < k else 0)
+                    candidates = prev[prev_rank] + cost[rest + 1, (v + 1)[:, None]] # dp[S - {v}][u] + c_uv
+                    best = candidates.argmin(axis=1)
+                    cur[start:stop, p] = np.minimum(candidates[rows, best], INF)
+                    parent[start:stop, p] = rest[rows, best]
+            parent.flush()
+            parents.append(parent)
+            prev = cur # Layer k-1 is no longer needed
+
+        total = prev[0] + cost[1:, 0] # The only subset of size n is everything, come back to node 0
+        v = int(total.argmin())
+        ans, tour = math.inf, [] # No closed circuit
+        if total[v] < INF:
+            ans, S = total[v].item(), list(range(n))
+            while len(S) > 1: # Follow the parents back to node 0
+                tour.append(v + 1)
+                u = int(parents[len(S)][rank_subset(comb, S), S.index(v)])
+                S.remove(v)
+                v = u
+            tour = [0, v + 1] + tour[::-1] + [0]
+        prev = cur = parent = None # Close the memory maps before the directory is removed
+        parents.clear()
+    return ans, tour
+
+# Fill dp[S][v] of the given subsets S, which all have the same size, from the layer of the size below
+def fill_subsets(dp, parent, cost, masks, INF):
+    for v in range(dp.shape[1]):
+        S = masks[(masks >> v) & 1 == 1] # Subsets that end at v
+        candidates = dp[S ^ (1 << v)] + cost[1:, v + 1] # dp[S - {v}][u] + c_uv for every u, inf when u is not in S - {v}
+        best = candidates.argmin(axis=1)
+        dp[S, v] = np.minimum(candidates[np.arange(len(S)), best], INF)
+        parent[S, v] = best
+
+# Return the function that fills the subsets of a layer with the given backend (see TSP_kernels.BACKENDS)
+def subset_filler(backend):
+    return compiled_fill_subsets if resolve_backend(backend) == "numba" else fill_subsets
+
+# Return the shapes and dtypes of the dp and parent tables for n nodes other than the start node
+def table_specs(n, dtype):
+    return [((1 << n, n), np.dtype(dtype)), ((1 << n, n), parent_dtype(n))]
+
+# Set the dp and parent tables to no path yet: dp[S][v] is INF and parent[S][v] is -1, no node before v
+def clear_tables(dp, parent, INF):
+    dp[:] = INF # dp[S][v]
+    parent[:] = -1 # The node visited before v, to rebuild the tour
+
+# Return new dp and parent tables for n nodes other than the start node, with no path yet
+def new_tables(n, dtype, INF):
+    dp, parent = [np.empty(shape, dtype=table_dtype) for shape, table_dtype in table_specs(n, dtype)]
+    clear_tables(dp, parent, INF)
+    return dp, parent
+
+# Fill the dp table bottom-up: the subsets of one node from cost, then fill_layer(masks) for the subsets of every size
+# from 2 to n, smallest first. Only the subsets for which stale(masks) is True are filled when stale is given.
+def fill_layers(dp, cost, fill_layer, stale=None):
+    n = dp.shape[1]
+    dp[1 << np.arange(n), np.arange(n)] = cost[0, 1:] # Go straight from node 0 to v
+    for masks in masks_by_size(n)[2:]: # Subsets with 2, 3, ..., n nodes
+        if stale is not None:
+            masks = masks[stale(masks)]
+        if len(masks):
+            fill_layer(masks)
+
+# Return the shortest tour length and the tour from the filled dp and parent tables
+def close_tour(dp, parent, cost, INF):
+    n = dp.shape[1]
+    full = (1 << n) - 1 # All nodes visited
+    total = dp[full] + cost[1:, 0] # Come back to node 0
+    v = int(total.argmin())
+    if total[v] >= INF: # No closed circuit
+        return math.inf, []
+    ans = total[v].item()
+    tour, S = [], full
+    while v != -1: # Follow the parents back to node 0
+        tour.append(v + 1)
+        S, v = S ^ (1 << v), int(parent[S, v])
+    return ans, [0] + tour[::-1] + [0]
+
+# Solve the TSP exactly with the Held-Karp dynamic programming, filled bottom-up by the number of visited nodes.
+# dp[S][v] is the shortest path that leaves node 0, visits the set S of the other nodes and ends at v (a member of S),
+# node i (1 <= i < V) is bit i-1 of S. Every dp[S][v] of one size only needs the layer of the size below it, and the
+# min over the previous node u is taken for all such S at once.
+# dtype is the type of the dp table: float32 halves the memory of float64, int32/int64 are exact for integer costs.
+# With memory_budget (bytes), instances whose tables do not fit are solved out-of-core by held_karp_layered.
+# workers > 1 fills every layer with that many processes (see held_karp_parallel).
+# backend selects the code that fills the layers, the Numba kernel or NumPy (see TSP_kernels.BACKENDS), the results are
+# the same. The out-of-core mode always uses NumPy.
+# Return the shortest tour length and the tour as a list of nodes from 0 back to 0 (math.inf and [] if there is none).
+def held_karp(cost_matrix, dtype=np.float64, memory_budget=None, spill_dir=None, workers=1, backend="auto"):
+    if memory_budget is not None and held_karp_memory(len(cost_matrix), dtype) > memory_budget:
+        return held_karp_layered(cost_matrix, dtype, memory_budget, spill_dir)
+    if workers > 1:
+        return held_karp_parallel(cost_matrix, workers, dtype, backend)
+    fill = subset_filler(backend)
+    dtype = np.dtype(dtype)
+    cost, INF = prepare_cost(cost_matrix, dtype) # c_ij: distance between node i and j
+    V = cost.shape[0]
+    if V == 1:
+        return 0, [0, 0]
+    n = V - 1 # Number of nodes other than the start node
+
+    dp, parent = new_tables(n, dtype, INF)
+    fill_layers(dp, cost, lambda masks: fill(dp, parent, cost, masks, INF))
+    return close_tour(dp, parent, cost, INF)
+
+# The dp and parent tables of held_karp kept after solving, so that the instance can be solved again after small edits
+# (a Delta of TSP_instance.py) without filling the whole table again. dp[S][v] only changes when the shortest paths
+# through S can use an edited distance, so only the subsets that contain both ends of a changed route (or the end v
+# of a changed route 0 -> v) are filled again. Routes back to node 0 are only used when the tour is closed.
+# A removed node keeps the subsets without it, an added node becomes the last one and keeps every subset without it,
+# only the subsets with the new node are filled. The tables stay in memory (see held_karp_memory).
+class HeldKarpTable():
+    def __init__(self, cost_matrix, dtype=np.float64, backend="auto"):
+        self.dtype = np.dtype(dtype)
+        self.fill = subset_filler(backend) # Fills the subsets of a layer, see held_karp
+        self.__fill(prepare_cost(cost_matrix, self.dtype)[0])
+
+    # Fill the whole table for the cost matrix
+    def __fill(self, cost):
+        self.cost, self.INF = cost, dp_inf(self.dtype)
+        self.dp, self.parent = new_tables(self.cost.shape[0] - 1, self.dtype, self.INF)
+        self.__refill()
+
+    # Fill dp[S][v] again for the subsets S of 2 or more nodes for which stale(masks) is True (all of them by default)
+    def __refill(self, stale=None):
+        fill_layers(self.dp, self.cost, lambda masks: self.fill(self.dp, self.parent, self.cost, masks, self.INF), stale)
+
+    # Return the shortest tour length and the tour as a list of nodes from 0 back to 0 (math.inf and [] if there is none)
+    def solve(self):
+        if self.cost.shape[0] == 1:
+            return 0, [0, 0]
+        return close_tour(self.dp, self.parent, self.cost, self.INF)
+
+    # Apply the edits of a Delta and fill the subsets they change. A removed node 0 changes every path, so the
+    # whole table is filled again.
+    def update(self, delta):
+        cost, INF = prepare_cost(delta.apply(self.cost.astype(np.float64)), self.dtype)
+        if delta.remove_city == 0:
+            self.__fill(cost)
+            return self.solve()
+        if delta.remove_city is not None: # Keep the subsets without the removed node, renumbered
+            removed = delta.remove_city - 1
+            n = self.dp.shape[1] - 1
+            masks = np.arange(1 << n)
+            low = (1 << removed) - 1
+            old_masks = (masks & low) | ((masks >> removed) << (removed + 1)) # Insert a zero bit for the removed node
+            keep = np.delete(np.arange(n + 1), removed)
+            self.dp = self.dp[np.ix_(old_masks, keep)]
+            parent = self.parent[np.ix_(old_masks, keep)]
+            self.parent = (parent - (parent > removed)).astype(parent_dtype(n))
+        if delta.add_city is not None: # Keep every subset, the new node is the highest bit
+            n = self.dp.shape[1]
+            dp, parent = new_tables(n + 1, self.dtype, INF)
+            dp[:1 << n, :n], parent[:1 << n, :n] = self.dp, self.parent
+            self.dp, self.parent = dp, parent
+        self.cost = cost
+        needed = [1 << (self.dp.shape[1] - 1)] if delta.add_city is not None else [] # Subsets that contain the added node
+        for i, j in delta.routes():
+            if j != 0: # Bits of both ends of the changed route, node 0 is in every path
+                needed.append((1 << (j - 1)) | (1 << (i - 1) if i != 0 else 0))
+        def stale(masks):
+            changed = np.zeros(len(masks), dtype=bool)
+            for bits in set(needed):
+                changed |= masks & bits == bits
+            return changed
+        if needed:
+            self.__refill(stale)
+        return self.solve()
+
+# Layers with fewer subsets than this are filled by the main process, the pool would only add overhead
+PARALLEL_MIN_SUBSETS = 1 << 12
+
+# The arrays of a worker process of held_karp_parallel, they live in shared memory blocks created by the main process
+_worker_arrays = None
+
+# Attach a worker process to the shared dp, parent and mask arrays. specs holds (name, shape, dtype) of each block.
+def _init_worker(specs, cost, INF, backend):
+    global _worker_arrays
+    blocks = [shared_memory.SharedMemory(name=name) for name, shape, dtype in specs]
+    arrays = [np.ndarray(shape, dtype=dtype, buffer=block.buf) for block, (name, shape, dtype) in zip(blocks, specs)]
+    _worker_arrays = (blocks, arrays, cost, INF, subset_filler(backend)) # Keep the blocks referenced while the arrays are in use
+
+# Fill the subsets masks[start:stop] in a worker process
+def _fill_subsets_range(start, stop):
+    blocks, (dp, parent, masks), cost, INF, fill = _worker_arrays
+    fill(dp, parent, cost, masks[start:stop], INF)
+
+# Held-Karp where the subsets of every layer are split over a pool of worker processes.
+# The dp, parent and mask arrays are created in multiprocessing.shared_memory, so the workers read the layer below
+# and write their part of the current layer in place, only (start, stop) ranges of the masks of the layer are sent to them.
+def held_karp_parallel(cost_matrix, workers, dtype=np.float64, backend="auto"):
+    fill = subset_filler(backend)
+    dtype = np.dtype(dtype)
+    cost, INF = prepare_cost(cost_matrix, dtype) # c_ij: distance between node i and j
+    V = cost.shape[0]
+    if V == 1:
+        return 0, [0, 0]
+    n = V - 1 # Number of nodes other than the start node
+
+    layer_size = max(math.comb(n, k) for k in range(n + 1)) # Subsets in the largest layer
+    specs, blocks, arrays = [], [], []
+    dp = parent = masks = None
+    try:
+        for shape, array_dtype in table_specs(n, dtype) + [((layer_size,), np.dtype(np.intp))]:
+            block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(array_dtype).itemsize))
+            blocks.append(block)
+            arrays.append(np.ndarray(shape, dtype=array_dtype, buffer=block.buf))
+            specs.append((block.name, shape, np.dtype(array_dtype)))
+        dp, parent, masks = arrays
+        clear_tables(dp, parent, INF)
+
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(specs, cost, INF, backend)) as executor:
+            # Fill the subsets of one layer, split over the workers
+            def fill_layer(layer):
+                if len(layer) < PARALLEL_MIN_SUBSETS:
+                    fill(dp, parent, cost, layer, INF)
+                    return
+                masks[:len(layer)] = layer
+                bounds = np.linspace(0, len(layer), workers + 1).astype(int)
+                for future in [executor.submit(_fill_subsets_range, lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])]:
+                    future.result() # The next layer needs all of this one
+            fill_layers(dp, cost, fill_layer)
+        return close_tour(dp, parent, cost, INF)
+    finally:
+        dp = parent = masks = None # Release the buffers before the blocks are closed
+        arrays.clear()
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+if __name__ == "__main__":
+    C = [
+            [math.inf, 30, 30, 25, 10],
+            [30, math.inf, 30, 45, 20],
+            [30, 30, math.inf, 25, 20],
+            [25, 45, 25, math.inf, 30],
+            [10, 20, 20, 30, math.inf]
+        ]
+
+    ans, tour = held_karp(C) # Start at vertex 0.
+    if ans == math.inf:
+        print(-1)
+    else:
+        print (ans)
+        print(" -> ".join(map(str, tour)))
@@ -0,0 +1,143 @@
+import collections
+import hashlib
+import json
+import math
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from TSP_BB_en import TSP
+from TSP_DP_en import held_karp
+from TSP_instance import as_matrix
+
+SOLVERS = ("bb", "dp") # Branch-and-bound (TSP_BB_en.TSP) or Held-Karp (TSP_DP_en.held_karp), both exact
+
+# Return the order of the cities that relabels the instance canonically, so that relabelled copies get the same matrix.
+# Cities are coloured by their sorted distances to and from the other colours, until the colours stop splitting
+# (colour refinement). Cities that still share a colour keep their original order.
+def canonical_order(cost):
+    n = cost.shape[0]
+    colours = np.zeros(n, dtype=int)
+    for _ in range(n):
+        signatures = [(colours[i], tuple(sorted(zip(cost[i].tolist(), colours.tolist()))), tuple(sorted(zip(cost[:, i].tolist(), colours.tolist())))) for i in range(n)]
+        ranking = {signature: rank for rank, signature in enumerate(sorted(set(signatures)))}
+        new_colours = np.array([ranking[signature] for signature in signatures])
+        if len(ranking) == len(set(colours.tolist())): # No colour was split, they are stable
+            break
+        colours = new_colours
+    return np.argsort(new_colours, kind="stable")
+
+# Return the fingerprint of an instance (a hash of its canonical matrix) and the canonical order of its cities
+def fingerprint(cost_matrix):
+    cost = as_matrix(cost_matrix)
+    order = canonical_order(cost)
+    canonical = np.ascontiguousarray(cost[np.ix_(order, order)], dtype="<f8")
+    key = hashlib.sha256(str(canonical.shape).encode() + canonical.tobytes()).hexdigest()
+    return key, order
+
+# LRU cache of solved instances keyed by fingerprint, optionally backed by one JSON file per instance under path.
+# Tours are stored in canonical labels.
+class SolutionCache():
+    def __init__(self, maxsize=1024, path=None):
+        self.maxsize = maxsize # Number of instances kept in memory
+        self.path = path # Directory of the on-disk store, None to keep the cache in memory only
+        self.entries = collections.OrderedDict() # fingerprint -> (value, tour), least recently used first
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    # Return (value, tour) of a fingerprint, or None when it has not been solved
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key) # Most recently used
+            return self.entries[key]
+        if self.path is not None and os.path.exists(self.__file(key)):
+            with open(self.__file(key)) as f:
+                entry = json.load(f)
+            self.__remember(key, (entry["value"], entry["tour"]))
+            return self.entries[key]
+        return None
+
+    # Store the solution of a fingerprint
+    def put(self, key, value, tour):
+        self.__remember(key, (value, tour))
+        if self.path is not None:
+            with open(self.__file(key), "w") as f:
+                json.dump({"value": value, "tour": tour}, f)
+
+    def __remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize: # Evict the least recently used
+            self.entries.popitem(last=False)
+
+    def __file(self, key):
+        return os.path.join(self.path, key + ".json")
+
+# The cache used when solve_batch is not given one, it lives as long as the process
+default_cache = SolutionCache()
+
+# Solve one canonical instance, return the tour length and the tour from 0 back to 0 (math.inf and [] if there is none)
+def _solve(canonical, solver):
+    if solver == "dp":
+        return held_karp(canonical)
+    suitable_val, suitable_route = TSP(canonical).getSuitableAns()
+    if suitable_val == math.inf:
+        return math.inf, []
+    return suitable_val, [int(city) for city in suitable_route.split(" -> ")]
+
+# Map a tour in canonical labels back to the labels of the instance, starting and ending at city 0 again
+def _relabel(tour, order):
+    if len(tour) == 0:
+        return []
+    cities = [int(order[city]) for city in tour[:-1]]
+    start = cities.index(0)
+    return cities[start:] + cities[:start] + [0]
+
+# Solve every matrix of an iterable with a pool of worker processes (None: one per core, 1: in this process).
+# Yield (index, value, tour) as soon as each instance is solved, so results do not come in input order.
+# Instances found in cache (default_cache if None) are answered without solving, relabelled copies included,
+# and identical instances in the same batch are solved once.
+def solve_batch(matrices, solver="bb", workers=None, cache=None):
+    if solver not in SOLVERS:
+        raise ValueError("unknown solver: {}, expected one of {}".format(solver, SOLVERS))
+    cache = default_cache if cache is None else cache
+    workers = os.cpu_count() if workers is None else workers
+
+    if workers == 1:
+        for index, cost_matrix in enumerate(matrices):
+            key, order = fingerprint(cost_matrix)
+            entry = cache.get(key)
+            if entry is None:
+                entry = _solve(as_matrix(cost_matrix)[np.ix_(order, order)], solver)
+                cache.put(key, *entry)
+            yield index, entry[0], _relabel(entry[1], order)
+        return
+
+    with ProcessPoolExecutor(workers) as executor:
+        running = {} # future -> fingerprint
+        waiting = {} # fingerprint -> [(index, order)] of the instances waiting for it
+
+        # Store the solutions of finished futures and return the results of the instances that waited for them
+        def collect(done):
+            results = []
+            for future in done:
+                key = running.pop(future)
+                value, tour = future.result()
+                cache.put(key, value, tour)
+                results += [(index, value, _relabel(tour, order)) for index, order in waiting.pop(key)]
+            return results
+
+        for index, cost_matrix in enumerate(matrices):
+            key, order = fingerprint(cost_matrix)
+            entry = cache.get(key)
+            if entry is not None:
+                yield index, entry[0], _relabel(entry[1], order)
+            elif key in waiting: # Already being solved
+                waiting[key].append((index, order))
+            else:
+                waiting[key] = [(index, order)]
+                canonical = as_matrix(cost_matrix)[np.ix_(order, order)]
+                running[executor.submit(_solve, canonical, solver)] = key
+                if len(running) >= workers * 2: # Do not read the iterable further ahead than the pool can use
+                    yield from collect(wait(running, return_when=FIRST_COMPLETED)[0])
+        while len(running) != 0:
+            yield from collect(wait(running, return_when=FIRST_COMPLETED)[0])
@@ -0,0 +1,190 @@
+import argparse
+import csv
+import json
+import math
+import sys
+import time
+import tracemalloc
+import numpy as np
+from TSP_BB_en import TSP
+from TSP_DP_en import held_karp
+from TSP_heuristic import HeuristicTSP
+from TSP_kernels import BACKENDS
+
+# Instance generators. Cities lie in a 1000 x 1000 square, distances are rounded to integers (as TSPLIB EUC_2D)
+# and the diagonal is inf. The same kind, size and seed always give the same matrix.
+
+# Return the distance matrix between the points (rows of a n x 2 array)
+def distance_matrix(points):
+    cost = np.rint(np.sqrt(((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=2)))
+    np.fill_diagonal(cost, np.inf)
+    return cost
+
+# Uniformly random cities
+def euclidean_instance(n, seed):
+    return distance_matrix(np.random.default_rng(seed).uniform(0, 1000, size=(n, 2)))
+
+# Cities in groups of about 5 around random centres
+def clustered_instance(n, seed):
+    rng = np.random.default_rng(seed)
+    centres = rng.uniform(0, 1000, size=(max(2, n // 5), 2))
+    points = centres[rng.integers(len(centres), size=n)] + rng.normal(0, 50, size=(n, 2))
+    return distance_matrix(points)
+
+# Uniformly random cities where c_ij and c_ji differ by up to 20 %
+def asymmetric_instance(n, seed):
+    rng = np.random.default_rng(seed)
+    cost = euclidean_instance(n, seed)
+    return np.rint(cost * rng.uniform(1.0, 1.2, size=(n, n)))
+
+INSTANCE_KINDS = {"euclidean": euclidean_instance, "clustered": clustered_instance, "asymmetric": asymmetric_instance}
+
+# Solvers. Each one takes a cost matrix and a backend (see TSP_kernels.BACKENDS) and returns the tour length and
+# the number of nodes it expanded (checked nodes for branch-and-bound, dp cells for Held-Karp, 0 for the heuristics).
+
+def _branch_and_bound(bound):
+    def solve(cost, backend):
+        salesman = TSP(cost, backend)
+        suitable_val, suitable_route = salesman.getSuitableAns(bound=bound)
+        return suitable_val, salesman.stats.nodes_checked
+    return solve
+
+def _held_karp(cost, backend):
+    V = cost.shape[0]
+    return held_karp(cost, backend=backend)[0], (1 << (V - 1)) * (V - 1)
+
+def _heuristic(cost, backend):
+    return TSP(cost, backend).getHeuristicAns()[0], 0
+
+def _candidate_heuristic(cost, backend):
+    return HeuristicTSP(cost).getHeuristicAns()[0], 0
+
+SOLVERS = {
+    "bb": _branch_and_bound("reduction"),
+    "bb-1tree": _branch_and_bound("1-tree"),
+    "bb-lagrangian": _branch_and_bound("lagrangian"),
+    "dp": _held_karp,
+    "heuristic": _heuristic,
+    "heuristic-large": _candidate_heuristic,
+}
+
+# Solvers whose inner loops depend on the backend, the others are only run with the first backend asked for
+BACKEND_SOLVERS = ("bb", "bb-1tree", "bb-lagrangian", "dp")
+
+# Run a solver once with tracemalloc on and return its peak memory. It is not timed, tracing slows the solvers down.
+def _peak_memory(solve, cost, backend):
+    tracemalloc.start()
+    try:
+        solve(cost, backend)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+# Run every solver on every instance with every backend and return one record per run.
+# wall_time is the fastest of repeat timed runs, peak_memory comes from one more untimed run with tracemalloc.
+# gap is the relative distance of the value to the best value any solver found on the instance, speedup is the wall time
+# of the same solver with the first backend divided by this wall time.
+def run(kinds, sizes, seeds, solvers, backends=("numpy",), repeat=3, log=sys.stderr):
+    runs = [(solver, backend) for solver in solvers for backend in (backends if solver in BACKEND_SOLVERS else backends[:1])]
+    for solver, backend in runs: # Compile the Numba kernels before anything is timed
+        SOLVERS[solver](euclidean_instance(5, 0), backend)
+    records = []
+    for kind in kinds:
+        for n in sizes:
+            for seed in seeds:
+                cost = INSTANCE_KINDS[kind](n, seed)
+                instance_records, first_times = [], {}
+                for solver, backend in runs:
+                    wall_time = math.inf
+                    for _ in range(max(1, repeat)):
+                        start_time = time.perf_counter()
+                        value, nodes = SOLVERS[solver](cost, backend)
+                        wall_time = min(wall_time, time.perf_counter() - start_time)
+                    peak_memory = _peak_memory(SOLVERS[solver], cost, backend)
+                    first_time = first_times.setdefault(solver, wall_time)
+                    instance_records.append({"instance": "{}-{}-{}".format(kind, n, seed), "kind": kind, "size": n, "seed": seed,
+                                             "solver": solver, "backend": backend, "value": float(value), "wall_time": wall_time,
+                                             "speedup": first_time / wall_time if wall_time > 0 else 1.0,
+                                             "nodes": int(nodes), "peak_memory": peak_memory})
+                    print("{instance} {solver} ({backend}): {value} in {wall_time:.3f}s (x{speedup:.2f}), {nodes} nodes, {peak_memory} bytes".format(**instance_records[-1]), file=log)
+                best = min(record["value"] for record in instance_records)
+                for record in instance_records:
+                    record["gap"] = (record["value"] - best) / best if 0 < best < math.inf else 0.0
+                records += instance_records
+    return records
+
+# Write the records to a .json or .csv file
+def save(records, path):
+    with open(path, "w", newline="") as f:
+        if path.endswith(".csv"):
+            writer = csv.DictWriter(f, fieldnames=list(records[0].keys()) if records else [])
+            writer.writeheader()
+            writer.writerows(records)
+        else:
+            json.dump(records, f, indent=1)
+
+# Read the records of a .json or .csv file
+def load(path):
+    with open(path, newline="") as f:
+        if not path.endswith(".csv"):
+            return json.load(f)
+        records = list(csv.DictReader(f))
+    for record in records: # csv only keeps strings
+        for field in ("value", "wall_time", "speedup", "gap"):
+            record[field] = float(record[field])
+        for field in ("size", "seed", "nodes", "peak_memory"):
+            record[field] = int(record[field])
+    return records
+
+# Compare the runs two result files have in common. A run regresses when its wall time grows by more than threshold
+# (a ratio), its value gets worse, or it expands more nodes. Return the list of regression messages.
+# Runs faster than min_time seconds in both files are not checked for time, their timings are mostly noise.
+# Records written before there were backends are numpy runs.
+def compare(old_records, new_records, threshold=1.2, min_time=0.05, log=sys.stdout):
+    old_runs = {(record["instance"], record["solver"], record.get("backend", "numpy")): record for record in old_records}
+    regressions = []
+    for record in new_records:
+        key = (record["instance"], record["solver"], record.get("backend", "numpy"))
+        if key not in old_runs:
+            continue
+        old = old_runs[key]
+        ratio = record["wall_time"] / old["wall_time"] if old["wall_time"] > 0 else 1.0
+        print("{} {} ({}): {:.3f}s -> {:.3f}s (x{:.2f}), nodes {} -> {}".format(*key, old["wall_time"], record["wall_time"], ratio, old["nodes"], record["nodes"]), file=log)
+        if ratio > threshold and max(old["wall_time"], record["wall_time"]) >= min_time:
+            regressions.append("{} {} ({}): {:.2f}x slower".format(*key, ratio))
+        if record["value"] > old["value"] * (1 + 1e-9):
+            regressions.append("{} {} ({}): value {} -> {}".format(*key, old["value"], record["value"]))
+        if record["nodes"] > old["nodes"]:
+            regressions.append("{} {} ({}): nodes {} -> {}".format(*key, old["nodes"], record["nodes"]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the TSP solvers on generated instances")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the solvers and write a result file")
+    run_parser.add_argument("--kinds", nargs="+", default=list(INSTANCE_KINDS), choices=list(INSTANCE_KINDS))
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[8, 10, 12])
+    run_parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 2])
+    run_parser.add_argument("--solvers", nargs="+", default=["bb-lagrangian", "dp", "heuristic"], choices=list(SOLVERS))
+    run_parser.add_argument("--backends", nargs="+", default=["numpy"], choices=[backend for backend in BACKENDS if backend != "auto"],
+                            help="backends of the bb and dp solvers, the speedup is relative to the first one")
+    run_parser.add_argument("--repeat", type=int, default=3, help="timed runs of every solver, the fastest one is kept")
+    run_parser.add_argument("--output", default="bench_results.json", help=".json or .csv file")
+    compare_parser = commands.add_parser("compare", help="compare two result files and fail on regressions")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=1.2, help="wall time ratio that counts as a regression")
+    compare_parser.add_argument("--min-time", type=float, default=0.05, help="seconds below which wall times are not compared")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        save(run(args.kinds, args.sizes, args.seeds, args.solvers, args.backends, args.repeat), args.output)
+    else:
+        regressions = compare(load(args.old), load(args.new), args.threshold, args.min_time)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import math
+import time
+import numpy as np
+from TSP_instance import CoordinateDistances, MatrixDistances, as_provider
+
+try: # The k-d tree of SciPy finds the neighbours of coordinate instances, without it they are found block by block
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+# Heuristic solver for large symmetric instances (thousands of cities), where the exact solvers of TSP_BB_en.py and
+# TSP_DP_en.py can not be used. The tour is improved by 2-opt and Or-opt moves that only try the candidates of a city
+# (its nearest neighbours), with a don't-look bit per city so that only cities near a change are looked at again.
+# The tour is kept in arrays (tour: the city at every position, pos: the position of every city), so that
+# the next and previous city are found in O(1) and a segment is reversed with NumPy slices.
+class HeuristicTSP():
+    NEIGHBOURS = 10 # Default number of candidates per city
+    BLOCK_ROWS = 256 # Rows per block when the neighbours are found without the k-d tree
+
+    # instance is a DistanceProvider or a distance matrix. Distances are assumed to be symmetric.
+    def __init__(self, instance, neighbours=NEIGHBOURS):
+        self.provider = as_provider(instance)
+        self.node_num = len(self.provider)
+        self.neighbours = max(1, min(neighbours, self.node_num - 1))
+        self.distance = self.__distanceFunction()
+        self.candidates = None # Candidate lists, computed by getHeuristicAns
+        self.tour = self.pos = None
+
+    # Return a function distance(i, j) on plain Python numbers: it is called for every move that is tried.
+    # Coordinate metrics are computed as in CoordinateDistances.block, one pair at a time.
+    def __distanceFunction(self):
+        if isinstance(self.provider, CoordinateDistances):
+            xs, ys = self.provider.points[:, 0].tolist(), self.provider.points[:, 1].tolist()
+            if self.provider.metric == "euclidean":
+                return lambda i, j: math.sqrt((xs[i] - xs[j]) ** 2 + (ys[i] - ys[j]) ** 2)
+            if self.provider.metric == "euc_2d":
+                return lambda i, j: math.floor(math.sqrt((xs[i] - xs[j]) ** 2 + (ys[i] - ys[j]) ** 2) + 0.5)
+            if self.provider.metric == "ceil_2d":
+                return lambda i, j: math.ceil(math.sqrt((xs[i] - xs[j]) ** 2 + (ys[i] - ys[j]) ** 2))
+            def att(i, j):
+                distance = math.sqrt(((xs[i] - xs[j]) ** 2 + (ys[i] - ys[j]) ** 2) / 10.0)
+                rounded = math.floor(distance + 0.5)
+                return rounded + (rounded < distance)
+            return att
+        if isinstance(self.provider, MatrixDistances):
+            rows = self.provider.cost.tolist()
+            return lambda i, j: rows[i][j]
+        return self.provider.distance
+
+    # Return the candidate lists, a n x neighbours array of the nearest cities of every city, nearest first.
+    # Coordinate instances use a k-d tree when SciPy is installed, other instances are read block by block.
+    def __candidateLists(self):
+        n, k = self.node_num, self.neighbours
+        if cKDTree is not None and isinstance(self.provider, CoordinateDistances):
+            _, nearest = cKDTree(self.provider.points).query(self.provider.points, k + 1)
+            others = nearest != np.arange(n)[:, None] # A city is its own nearest neighbour, unless it has duplicates
+            order = np.argsort(~others, axis=1, kind="stable")
+            return np.take_along_axis(nearest, order, axis=1)[:, :k]
+        candidates = np.empty((n, k), dtype=np.int64)
+        for start in range(0, n, self.BLOCK_ROWS):
+            rows = np.arange(start, min(start + self.BLOCK_ROWS, n))
+            cost = self.provider.block(rows, np.arange(n))
+            nearest = np.argpartition(cost, k - 1, axis=1)[:, :k]
+            order = np.argsort(np.take_along_axis(cost, nearest, axis=1), axis=1, kind="stable")
+            candidates[rows] = np.take_along_axis(nearest, order, axis=1)
+        return candidates
+
+    # Build a tour with the greedy edge heuristic: take the candidate routes from the shortest one up, skipping those that
+    # would give a city three routes or close a cycle (union-find), then join the paths left by nearest neighbour
+    # from the end of one path to the nearest end of another one.
+    def __greedyTour(self):
+        n = self.node_num
+        first = np.repeat(np.arange(n), self.neighbours)
+        second = self.candidates.ravel()
+        routes = np.unique(np.minimum(first, second) * n + np.maximum(first, second)) # Every route once
+        first, second = routes // n, routes % n
+        length = np.array([self.distance(i, j) for i, j in zip(first.tolist(), second.tolist())])
+        adjacent = [[] for _ in range(n)]
+        root = list(range(n))
+        def find(city):
+            while root[city] != city:
+                root[city] = root[root[city]]
+                city = root[city]
+            return city
+        for index in np.argsort(length, kind="stable").tolist():
+            i, j = int(first[index]), int(second[index])
+            if len(adjacent[i]) < 2 and len(adjacent[j]) < 2 and find(i) != find(j):
+                root[find(i)] = find(j)
+                adjacent[i].append(j)
+                adjacent[j].append(i)
+        visited = np.zeros(n, dtype=bool)
+        ends = np.array([city for city in range(n) if len(adjacent[city]) < 2])
+        tour = np.empty(n, dtype=np.int64)
+        position, city = 0, int(ends[0])
+        while True:
+            previous = -1
+            while True: # Walk along the path from the end city
+                tour[position] = city
+                position += 1
+                visited[city] = True
+                following = [next_city for next_city in adjacent[city] if next_city != previous]
+                if not following:
+                    break
+                previous, city = city, following[0]
+            if position == n:
+                return tour
+            for next_city in self.candidates[city].tolist():
+                if len(adjacent[next_city]) < 2 and not visited[next_city]:
+                    break
+            else:
+                ends = ends[~visited[ends]]
+                next_city = int(ends[np.argmin(self.provider.block(np.array([city]), ends)[0])])
+            city = next_city
+
+    def __next(self, city):
+        return int(self.tour[(self.pos[city] + 1) % self.node_num])
+
+    def __prev(self, city):
+        return int(self.tour[self.pos[city] - 1])
+
+    # Reverse the path from city first to city last (in the direction of the tour). When the path is longer than
+    # half the tour the rest of the tour is reversed instead, which gives the same closed circuit.
+    def __reversePath(self, first, last):
+        n = self.node_num
+        i, j = int(self.pos[first]), int(self.pos[last])
+        length = (j - i) % n + 1
+        if 2 * length > n:
+            i, j, length = (j + 1) % n, (i - 1) % n, n - length
+        if length < 2:
+            return
+        if i + length <= n:
+            positions = slice(i, i + length)
+            self.tour[positions] = self.tour[positions][::-1].copy()
+            self.pos[self.tour[positions]] = np.arange(i, i + length)
+        else: # The path wraps around the end of the arrays
+            positions = np.arange(i, i + length) % n
+            self.tour[positions] = self.tour[positions][::-1]
+            self.pos[self.tour[positions]] = positions
+
+    # Replace the routes a-b and c-d by a-c and b-d. b follows a and d follows c, both in the same direction.
+    def __move2Opt(self, a, b, c, d):
+        if self.__next(a) == b:
+            self.__reversePath(b, c)
+        else:
+            self.__reversePath(a, d)
+
+    # Try the 2-opt moves that add a route from city a to one of its candidates, apply the best one.
+    # Return the cities whose routes changed, or None.
+    def __improve2Opt(self, a):
+        best_gain, best_move = 1e-9, None
+        for succ in (True, False):
+            b = self.__next(a) if succ else self.__prev(a)
+            a_b = self.distance(a, b)
+            for c in self.candidates[a].tolist():
+                gain = a_b - self.distance(a, c)
+                if gain <= 0: # Candidates are sorted, the next ones are no closer
+                    break
+                d = self.__next(c) if succ else self.__prev(c)
+                if c == b or d == a:
+                    continue
+                gain += self.distance(c, d) - self.distance(b, d)
+                if gain > best_gain:
+                    best_gain, best_move = gain, (a, b, c, d)
+        if best_move is not None:
+            self.__move2Opt(*best_move)
+        return best_move
+
+    # Try to move the segment of 1 to 3 cities starting at city a between a candidate of one of its ends and
+    # the city before or after it, possibly reversed, apply the first improving move.
+    # Return the cities whose routes changed, or None.
+    def __improveOrOpt(self, a):
+        first = last = a
+        for length in range(1, min(3, self.node_num - 3) + 1):
+            if length > 1:
+                last = self.__next(last)
+            segment = set()
+            city = first
+            while True:
+                segment.add(city)
+                if city == last:
+                    break
+                city = self.__next(city)
+            p, q = self.__prev(first), self.__next(last)
+            removed = self.distance(p, first) + self.distance(last, q) - self.distance(p, q)
+            if removed <= 1e-9:
+                continue
+            for end in (first, last):
+                for c in self.candidates[end].tolist():
+                    if self.distance(c, end) >= removed: # No insertion next to c can gain
+                        break
+                    if c in segment:
+                        continue
+                    for x, y in ((c, self.__next(c)), (self.__prev(c), c)): # Insert between x and y, y follows x
+                        if y in segment or x in segment or y == p:
+                            continue
+                        x_y = removed + self.distance(x, y)
+                        forward = x_y - self.distance(x, first) - self.distance(last, y)
+                        backward = x_y - self.distance(x, last) - self.distance(first, y)
+                        if max(forward, backward) > 1e-9:
+                            self.__moveOrOpt(p, first, last, q, x, y, forward >= backward)
+                            return (p, first, last, q, x, y)
+        return None
+
+    # Move the segment first..last (p before it, q after it) between x and y (y follows x) with three 2-opt moves,
+    # x -> first ... last -> y when forward is set, x -> last ... first -> y otherwise
+    def __moveOrOpt(self, p, first, last, q, x, y, forward):
+        self.__move2Opt(p, first, x, y) # p -> x ... q -> last ... first -> y
+        self.__move2Opt(p, x, q, last) # p -> q ... x -> last ... first -> y
+        if forward:
+            self.__move2Opt(x, last, first, y)
+
+    # Improve the tour with candidate 2-opt and Or-opt moves until no city with its don't-look bit off finds one.
+    # Cities are checked in a queue, a city whose routes changed is put back in it (its don't-look bit is reset).
+    def __localSearch(self, deadline):
+        queue = list(range(self.node_num))
+        queued = [True] * self.node_num
+        head = 0
+        while head < len(queue):
+            if head % 1024 == 0 and time.monotonic() >= deadline:
+                break
+            a = queue[head]
+            head += 1
+            queued[a] = False
+            changed = self.__improve2Opt(a) or self.__improveOrOpt(a)
+            if changed:
+                for city in changed:
+                    if not queued[city]:
+                        queued[city] = True
+                        queue.append(city)
+            if head > self.node_num and 2 * head > len(queue): # Drop the checked part of the queue
+                queue, head = queue[head:], 0
+
+    # Return the length of the closed circuit through the cities of tour in that order
+    def tourLength(self, tour):
+        if len(tour) < 2:
+            return 0.0
+        return float(sum(self.distance(int(a), int(b)) for a, b in zip(tour, np.roll(tour, -1))))
+
+    # Compute a good closed circuit (greedy edges, then candidate 2-opt and Or-opt), return its length and the tour
+    # (array of cities starting at city 0). time_limit (seconds) stops the local search early with the best tour so far.
+    def getHeuristicAns(self, time_limit=None):
+        deadline = math.inf if time_limit is None else time.monotonic() + time_limit
+        if self.node_num < 4: # Every closed circuit is the same
+            tour = np.arange(self.node_num)
+            return self.tourLength(tour), tour
+        self.candidates = self.__candidateLists()
+        self.tour = self.__greedyTour()
+        self.pos = np.empty(self.node_num, dtype=np.int64)
+        self.pos[self.tour] = np.arange(self.node_num)
+        self.__localSearch(deadline)
+        tour = np.roll(self.tour, -int(self.pos[0])) # Start the tour at city 0
+        return self.tourLength(tour), tour
+
+
+if __name__ == "__main__":
+    points = np.random.default_rng(0).uniform(0, 1000, size=(10000, 2))
+    start_time = time.perf_counter()
+    route_length, tour = HeuristicTSP(CoordinateDistances(points)).getHeuristicAns()
+    print("{} cities: {:.1f} in {:.2f}s".format(len(tour), route_length, time.perf_counter() - start_time))
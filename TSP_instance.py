@@ -0,0 +1,195 @@
+import numpy as np
+
+# The distances of an instance, the one interface every solver reads distances through.
+# Cities are 0, ..., size-1 and the distance from a city to itself is inf (as on the diagonal of the matrices in this repo).
+class DistanceProvider():
+    def __init__(self, size):
+        self.size = size # Number of cities
+
+    def __len__(self):
+        return self.size
+
+    # Return the distances from every city of rows to every city of cols (arrays of city numbers) as a 2-D array
+    def block(self, rows, cols):
+        raise NotImplementedError
+
+    # Return the distance from city i to city j
+    def distance(self, i, j):
+        return float(self.block(np.array([i]), np.array([j]))[0, 0])
+
+    # Return the distances from city i to every city
+    def row(self, i):
+        return self.block(np.array([i]), np.arange(self.size))[0]
+
+    # Return the whole distance matrix, computed block by block of block_rows rows
+    def matrix(self, block_rows=1024):
+        cost = np.empty((self.size, self.size))
+        for start in range(0, self.size, block_rows):
+            rows = np.arange(start, min(start + block_rows, self.size))
+            cost[rows] = self.block(rows, np.arange(self.size))
+        return cost
+
+# Distances given as a dense matrix (a list of lists like C in TSP_BB_en.py, or an array)
+class MatrixDistances(DistanceProvider):
+    def __init__(self, cost_matrix):
+        self.cost = np.array(cost_matrix, dtype=np.float64)
+        np.fill_diagonal(self.cost, np.inf)
+        super().__init__(self.cost.shape[0])
+
+    def block(self, rows, cols):
+        return self.cost[np.ix_(rows, cols)]
+
+    def matrix(self, block_rows=1024):
+        return self.cost
+
+# Distances between points (a n x 2 array of coordinates), computed only when asked for, in NumPy blocks.
+# metric is "euclidean" (exact), or one of the TSPLIB integer metrics "euc_2d" (rounded), "ceil_2d" (rounded up)
+# and "att" (pseudo-Euclidean).
+class CoordinateDistances(DistanceProvider):
+    METRICS = ("euclidean", "euc_2d", "ceil_2d", "att")
+
+    def __init__(self, points, metric="euclidean"):
+        if metric not in self.METRICS:
+            raise ValueError("unknown metric: {}, expected one of {}".format(metric, self.METRICS))
+        self.points = np.asarray(points, dtype=np.float64)
+        self.metric = metric
+        super().__init__(self.points.shape[0])
+
+    def block(self, rows, cols):
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        delta = self.points[rows, None, :] - self.points[None, cols, :]
+        squared = (delta ** 2).sum(axis=2)
+        if self.metric == "euclidean":
+            cost = np.sqrt(squared)
+        elif self.metric == "euc_2d":
+            cost = np.floor(np.sqrt(squared) + 0.5)
+        elif self.metric == "ceil_2d":
+            cost = np.ceil(np.sqrt(squared))
+        else: # att
+            distance = np.sqrt(squared / 10.0)
+            cost = np.floor(distance + 0.5)
+            cost += cost < distance
+        cost[rows[:, None] == cols[None, :]] = np.inf
+        return cost
+
+# Return the dense distance matrix of an instance: a DistanceProvider, or a matrix as a list of lists or array
+def as_matrix(instance):
+    if isinstance(instance, DistanceProvider):
+        return instance.matrix()
+    return np.array(instance, dtype=np.float64)
+
+# Return the DistanceProvider of an instance: a DistanceProvider is returned as it is, a matrix is wrapped
+def as_provider(instance):
+    if isinstance(instance, DistanceProvider):
+        return instance
+    return MatrixDistances(instance)
+
+# Edits of an instance between two runs, applied in this order: changes maps routes (i, j) to their new distance c_ij,
+# the city remove_city is removed (the cities after it move down by one), and add_city = (row, col) adds a city as the
+# last one, row[j] being the distance from it to city j and col[i] the distance from city i to it.
+class Delta():
+    def __init__(self, changes=None, remove_city=None, add_city=None):
+        self.changes = dict(changes or {})
+        self.remove_city = remove_city
+        self.add_city = add_city
+
+    # Return the distance matrix of an instance (a matrix or a DistanceProvider) after the edits, as a new array
+    def apply(self, instance):
+        cost = np.array(as_matrix(instance), dtype=np.float64)
+        for (i, j), distance in self.changes.items():
+            if i != j:
+                cost[i, j] = distance
+        if self.remove_city is not None:
+            cost = np.delete(np.delete(cost, self.remove_city, axis=0), self.remove_city, axis=1)
+        if self.add_city is not None:
+            n = cost.shape[0]
+            grown = np.full((n + 1, n + 1), np.inf)
+            grown[:n, :n] = cost
+            grown[n, :n], grown[:n, n] = self.add_city
+            cost = grown
+        return cost
+
+    # Return the changed routes (i, j) in the numbering after the edits. The routes of a removed city are left out,
+    # those of an added city are not listed either.
+    def routes(self):
+        routes = set()
+        for i, j in self.changes:
+            if i == j or self.remove_city in (i, j):
+                continue
+            routes.add(tuple(city - (self.remove_city is not None and city > self.remove_city) for city in (i, j)))
+        return sorted(routes)
+
+    # Return a tour (list of cities) of the instance before the edits in the numbering after them. The removed city
+    # is left out, an added city is not in it yet.
+    def renumber(self, tour):
+        if self.remove_city is None:
+            return list(tour)
+        return [city - (city > self.remove_city) for city in tour if city != self.remove_city]
+
+# Read the numbers of a section of a file until count of them have been read, one line at a time
+def _read_numbers(f, count):
+    chunks, read = [], 0
+    while read < count:
+        line = f.readline()
+        if line == "":
+            raise ValueError("the file ends {} numbers before the end of the section".format(count - read))
+        numbers = np.array(line.split(), dtype=np.float64)
+        chunks.append(numbers)
+        read += len(numbers)
+    if count == 0: # An empty section, e.g. an edge list without edges
+        return np.empty(0)
+    return np.concatenate(chunks)[:count]
+
+# Return the matrix of an EXPLICIT TSPLIB instance from the numbers of its EDGE_WEIGHT_SECTION
+def _explicit_matrix(numbers, n, edge_weight_format):
+    cost = np.zeros((n, n))
+    if edge_weight_format == "FULL_MATRIX":
+        cost[:] = numbers.reshape(n, n)
+    else:
+        offset = 0 if edge_weight_format.endswith("DIAG_ROW") else 1
+        if edge_weight_format.startswith("UPPER"):
+            cost[np.triu_indices(n, offset)] = numbers # Both index functions list the triangle row by row
+        else:
+            cost[np.tril_indices(n, -offset)] = numbers
+        cost = cost + cost.T # The other triangle is still zero
+    np.fill_diagonal(cost, np.inf)
+    return cost
+
+# Read a TSPLIB file (TYPE TSP or ATSP). Coordinates (NODE_COORD_SECTION, metrics EUC_2D, CEIL_2D and ATT) give a
+# CoordinateDistances whose distances are only computed when needed, explicit weights give a MatrixDistances.
+# Sections are read in bulk, without building Python lists of the numbers.
+def load_tsplib(path):
+    header = {}
+    with open(path) as f:
+        while True:
+            line = f.readline()
+            if line == "":
+                raise ValueError("no NODE_COORD_SECTION or EDGE_WEIGHT_SECTION in {}".format(path))
+            line = line.strip()
+            if line.startswith("NODE_COORD_SECTION"):
+                n = int(header["DIMENSION"])
+                coordinates = _read_numbers(f, 3 * n).reshape(n, 3) # node number, x, y
+                metric = header.get("EDGE_WEIGHT_TYPE", "EUC_2D").lower()
+                if metric not in CoordinateDistances.METRICS:
+                    raise ValueError("unsupported EDGE_WEIGHT_TYPE: {}".format(header["EDGE_WEIGHT_TYPE"]))
+                return CoordinateDistances(coordinates[np.argsort(coordinates[:, 0]), 1:], metric)
+            if line.startswith("EDGE_WEIGHT_SECTION"):
+                n = int(header["DIMENSION"])
+                edge_weight_format = header.get("EDGE_WEIGHT_FORMAT", "FULL_MATRIX")
+                count = {"FULL_MATRIX": n * n, "UPPER_ROW": n * (n - 1) // 2, "LOWER_ROW": n * (n - 1) // 2,
+                         "UPPER_DIAG_ROW": n * (n + 1) // 2, "LOWER_DIAG_ROW": n * (n + 1) // 2}.get(edge_weight_format)
+                if count is None:
+                    raise ValueError("unsupported EDGE_WEIGHT_FORMAT: {}".format(edge_weight_format))
+                return MatrixDistances(_explicit_matrix(_read_numbers(f, count), n, edge_weight_format))
+            if ":" in line:
+                key, value = line.split(":", 1)
+                header[key.strip().upper()] = value.strip()
+
+# Read an edge list as read by DP2.py: a line "V E", then E lines "s t d" for a route of length d from s to t.
+# f is an open file (sys.stdin for instance). Routes that are not listed are inf.
+def load_edge_list(f):
+    V, E = map(int, f.readline().split())
+    edges = _read_numbers(f, 3 * E).reshape(E, 3)
+    cost = np.full((V, V), np.inf)
+    cost[edges[:, 0].astype(int), edges[:, 1].astype(int)] = edges[:, 2]
+    return MatrixDistances(cost)
@@ -1,75 +1,73 @@
 import numpy as np
-from pandas import DataFrame
 import math
 import copy
 import time
 
 class Salesman():
     def __init__(self, route_list):
-        self.route_df = DataFrame(route_list)
+        self.route_arr = np.array(route_list, dtype=float) # 距離行列, c_ijは都市iから都市jへの距離
         self.stack_search_nodes = [] # 緩和問題の解を出してstackしたnode群
         self.present_nodes = [] # まさに探索中のnode(1つか2つ)
         self.suitable_val = math.inf # 暫定値
         self.suitable_ans = [] # 暫定解
-        self.node_num = self.route_df.shape[0] # nodeの個数
-
-    # 与えられたDataFrameのうち最小値の[index, column]の一組を返す
-    def __minimumRoute(self, target_route_df):
-        min_index = target_route_df.idxmin(axis=1) # 各行ごとに最小値のcolumn
-        minimum = math.inf # 最小値の初期値
-        loc = [-1, -1] # 位置の初期値
-        for index, column in zip(min_index.index, min_index.values):
-            if math.isnan(column): # 行全てinfのときはNaNとなる, これは最小にならない
-                continue
-            if minimum > target_route_df[column][index]:
-                minimum = target_route_df[column][index] # 最小値の更新
-                loc = [index, column] # index, column位置の更新
-        return loc
-
-    # デフォルトのDataFrameと経路選択の配列を与えると最適値を返す
-    def __calcSuitableSum(self, route_list):
-        route_df_tmp = copy.deepcopy(self.route_df)
-        route_length = 0
-        for route in route_list:
-            if route[2] == 0: # このrouteを選択するとき
-                route_length += route_df_tmp[route[1]][route[0]] # 経路長に追加
-                if (route[1] in route_df_tmp.index and route[0] in route_df_tmp.columns): # 小さくなった経路のDataFrameに該当要素がまだ存在するとき
-                    route_df_tmp[route[0]][route[1]] = math.inf # DataFrame[column][index], 該当の道の逆経路(1->2のとき2->1)は採択しないのでinfとする
-                route_df_tmp = route_df_tmp.drop(route[0], axis=0) # 該当経路の行削除
-                route_df_tmp = route_df_tmp.drop(route[1], axis=1) # 該当経路の列削除
-            else: # このrouteを選択しないとき
-                if (route[0] in route_df_tmp.index and route[1] in route_df_tmp.columns): # 小さくなった経路のDataFrameに該当要素がまだ存在するとき
-                    route_df_tmp[route[1]][route[0]] = math.inf # 採用しないので該当の経路をinfとする
-
-        min_sum = 0 # 緩和問題の経路長を足していく
-        next_route = copy.deepcopy(route_df_tmp) # この時点のDataFrameをnext_routeに保持
-        for index in route_df_tmp.index: # 各行で実行
-            min_tmp = route_df_tmp.loc[index, :].min() # 行の最小値を取得
-            min_sum += min_tmp # 最小値を足す
-            route_df_tmp.loc[index, :] = route_df_tmp.loc[index, :] - min_tmp # その行の各要素から最小値を引く
-        for column in route_df_tmp.columns: # 各列で実行
-            min_tmp = route_df_tmp.loc[:, column].min() # 列の最小値を取得
-            min_sum += min_tmp # 最小値を足す
-            route_df_tmp.loc[:, column] = route_df_tmp.loc[:, column] - min_tmp # その列の各要素から最小値を引く
-        route_length += min_sum # 経路長に追加
-        return route_length, next_route # 経路長とそのノード時点の経路のDataFrame
+        self.node_num = self.route_arr.shape[0] # nodeの個数
+
+    # 根ノードの縮約行列を返す. 縮約行列は(行列, 有効な行, 有効な列)の組
+    def __rootReduced(self):
+        matrix = self.route_arr.copy() # 固定サイズの配列, 行と列は削除せず無効にするだけ
+        rows = np.ones(self.node_num, dtype=bool) # まだ有効な行(始点)
+        cols = np.ones(self.node_num, dtype=bool) # まだ有効な列(終点)
+        route_length = self.__reduceMatrix(matrix, rows, cols)
+        return route_length, (matrix, rows, cols)
+
+    # 有効な各行, 次に有効な各列から最小値を引き, 引いた値の合計を返す
+    def __reduceMatrix(self, matrix, rows, cols):
+        index = np.ix_(np.flatnonzero(rows), np.flatnonzero(cols))
+        sub_matrix = matrix[index]
+        row_min = sub_matrix.min(axis=1, keepdims=True) # 各行の最小値
+        if np.isinf(row_min).any(): # 行全てinfのときはその都市から出られない
+            return math.inf
+        sub_matrix -= row_min
+        col_min = sub_matrix.min(axis=0, keepdims=True) # 各列の最小値
+        if np.isinf(col_min).any(): # 列全てinfのときはその都市に入れない
+            return math.inf
+        sub_matrix -= col_min
+        matrix[index] = sub_matrix
+        return float(row_min.sum() + col_min.sum())
+
+    # 与えられた縮約行列のうち最小値の[index, column]の一組を返す
+    def __minimumRoute(self, target_reduced):
+        matrix, rows, cols = target_reduced
+        row_index, col_index = np.flatnonzero(rows), np.flatnonzero(cols)
+        # 選択は元の距離で行う, もう使えない経路は縮約行列でinfになっている
+        sub_matrix = np.where(np.isinf(matrix), math.inf, self.route_arr)[np.ix_(row_index, col_index)]
+        if sub_matrix.size == 0 or np.isinf(sub_matrix).all(): # 全てinfのときは最小にならない
+            return [-1, -1]
+        row, col = divmod(int(np.argmin(sub_matrix)), len(col_index)) # 行順で最初の最小値
+        return [int(row_index[row]), int(col_index[col])]
+
+    # 親ノードと子の経路選択の配列を与えると子の最適値を返す
+    def __calcSuitableSum(self, route_list, parent_node):
+        matrix, rows, cols = parent_node[1] # 親の縮約済みの行列
+        matrix, rows, cols = matrix.copy(), rows.copy(), cols.copy()
+        route_length = parent_node[2] # 親の最適値から始める
+        route = route_list[-1] # 親と違うのは最後のrouteだけ
+        if route[2] == 0: # このrouteを選択するとき
+            route_length += matrix[route[0], route[1]] # 縮約後の経路長に追加
+            if rows[route[1]] and cols[route[0]]: # 縮約行列に逆経路がまだ存在するとき
+                matrix[route[1], route[0]] = math.inf # 該当の道の逆経路(1->2のとき2->1)は採択しないのでinfとする
+            rows[route[0]] = False # 該当経路の行を無効にする
+            cols[route[1]] = False # 該当経路の列を無効にする
+        else: # このrouteを選択しないとき
+            matrix[route[0], route[1]] = math.inf # 採用しないので該当の経路をinfとする
+        route_length += self.__reduceMatrix(matrix, rows, cols) # routeに関わる行と列だけがまだ縮約できる
+        return route_length, (matrix, rows, cols) # 経路長とそのノード時点の縮約行列
 
     # 一巡閉路かチェックする
-    def __checkClosedCircle(self, route_list, route_df_tmp):
-        # route_df_tmpは2x2であることが前提
-        mini_route = self.__minimumRoute(route_df_tmp) # route_df_tmpの最小の要素の[index, coumn]
-        if mini_route == [-1, -1]: #route_df_tmpが全てinfのとき
-            return False
-        mini_route.append(0) # 採択するrouteなので0を追加
-        route_list.append(mini_route) # routeリストに追加
-        route_df_tmp = route_df_tmp.drop(mini_route[0], axis=0) # 行削除
-        route_df_tmp = route_df_tmp.drop(mini_route[1], axis=1) # 列削除
-        last_route = [route_df_tmp.index[0], route_df_tmp.columns[0]] # 残りの要素を取得
-        last_route.append(0) # 採択するrouteなので0を追加
-        route_list.append(last_route) # routeリストに追加
-
+    def __checkClosedCircle(self, route_list):
         label, counter = 0, 0 # labelは現在の位置, counterは移動回数
         for i in range(self.node_num): # 繰り返しの最大はノードの個数
+            new_label = label
             for route in route_list:
                 if route[0] == label and route[2] == 0: # 始点がlabelで採択経路であれば
                     new_label = route[1] # labelの更新
@@ -82,34 +80,50 @@ class Salesman():
         else:
             return False
 
+    # 2x2のノードの経路を2通りの方法で閉じ, 最良の一巡閉路とその経路長を返す
+    def __closeRoute(self, route_list, target_reduced):
+        matrix, rows, cols = target_reduced
+        (row_0, row_1), (col_0, col_1) = np.flatnonzero(rows).tolist(), np.flatnonzero(cols).tolist()
+        best_length, best_route = math.inf, None
+        for last_routes in ([[row_0, col_0, 0], [row_1, col_1, 0]], [[row_0, col_1, 0], [row_1, col_0, 0]]):
+            if any(math.isinf(matrix[route[0], route[1]]) for route in last_routes): # もう使えない経路
+                continue
+            closed_route = route_list + last_routes
+            if self.__checkClosedCircle(closed_route): # 一巡閉路であるか
+                route_length = float(sum(self.route_arr[route[0], route[1]] for route in closed_route if route[2] == 0))
+                if best_length > route_length:
+                    best_length, best_route = route_length, closed_route
+        return best_length, best_route
+
     # あるノードまでの経路に新たな経路を追加しpresent_nodesに追加する
-    def __setPresentNodes(self, target_route, target_branch):
+    def __setPresentNodes(self, target_route, target_node):
         for status in range(2):
             target_route_tmp = copy.deepcopy(target_route) # target_eleをコピー
             target_route_tmp.append(status) # status(採択の可否）を追加
-            target_branch_tmp = copy.deepcopy(target_branch) # target_branchをコピー
+            target_branch_tmp = copy.deepcopy(target_node[0]) # 親のbranchをコピー
             target_branch_tmp.append(target_route_tmp) # routeを追加
-            self.present_nodes.append(target_branch_tmp) # present_nodesに追加
+            self.present_nodes.append([target_branch_tmp, target_node]) # 親と一緒にpresent_nodesに追加
 
     # 該当ノードを評価する, 分岐が可能ならノードを評価, 分岐が終了なら暫定値との比較
     def __evaluateNode(self, target_node):
-        if (False if target_node[1].shape == (2, 2) else True):  # まだ分岐いけるとき, 判断はtarget_nodeのDataFrameが2x2に到達していないこと
+        if target_node[1][1].sum() > 2:  # まだ分岐いけるとき, 判断はtarget_nodeの縮約行列が2x2に到達していないこと
             next_route = self.__minimumRoute(target_node[1]) # 最小の要素を取得 [index, column]
             if next_route != [-1, -1]: # [-1, -1]のときは距離がinfになるので不適, present_nodesには何も追加しない
-                self.__setPresentNodes(next_route, target_node[0])
+                self.__setPresentNodes(next_route, target_node)
         else: # 分岐終わりのとき
-            if self.__checkClosedCircle(target_node[0], target_node[1]): # 一巡閉路であるか
-                if self.suitable_val > target_node[2]: # 暫定値より小さいか
-                    self.suitable_val = target_node[2] # 暫定値の更新
-                    self.suitable_ans = target_node[0] # 暫定解の更新
+            route_length, route_list = self.__closeRoute(target_node[0], target_node[1])
+            if self.suitable_val > route_length: # 暫定値より小さいか
+                self.suitable_val = route_length # 暫定値の更新
+                self.suitable_ans = route_list # 暫定解の更新
         print("suitable_solution, tn[0]:{}".format(target_node[0]))
-        print("dataframe, tn[1]:{}".format(target_node[1]))
+        print("reduced matrix, tn[1]:{}".format(target_node[1][0]))
         print("suitable_value, tn[2]:{}".format(target_node[2]))
 
     # 経路のリストをpathに変換する
     def __displayRoutePath(self, route_list):
         label, counter, route_path = 0, 0, "0" # labelは現在の位置, counterは移動回数, route_pathは経路
         for i in range(self.node_num): # 繰り返しの最大はノードの個数
+            new_label = label
             for route in route_list:
                 if route[0] == label and route[2] == 0: # 始点がlabelで採択経路であれば
                     new_label = route[1] # labelの更新
@@ -122,18 +136,24 @@ class Salesman():
 
     # 最適値と最適解を計算する (メインのメソッド)
     def getSuitableAns(self):
-        target_route = self.__minimumRoute(self.route_df) # routeのDataFrameの最小要素を取得
-        self.__setPresentNodes(target_route, []) # present_nodesにセット
+        route_length, root_reduced = self.__rootReduced() # 行列全体を一度だけ縮約
+        root_node = [[], root_reduced, route_length]
+        if self.node_num == 2: # すでに2x2の行列なので分岐するものがない
+            self.__evaluateNode(root_node)
+        elif route_length != math.inf:
+            target_route = self.__minimumRoute(root_reduced) # 行列の最小要素を取得
+            self.__setPresentNodes(target_route, root_node) # present_nodesにセット
         while True:
             if self.suitable_val != math.inf: # 最適解の暫定値がセットされているとき
                 self.stack_search_nodes = list(filter(lambda node: node[2] < self.suitable_val, self.stack_search_nodes))
                 # stackされているノードの緩和問題の解が暫定値を超えていたら除く
 
             while len(self.present_nodes) != 0: # 探索のリストが存在するならば緩和問題の解を問いてstack
-                first_list = self.present_nodes[0] # present_nodesを評価するために取得
+                first_list, parent_node = self.present_nodes[0] # present_nodesを評価するために取得
                 self.present_nodes.pop(0) # 評価するのでpresent_nodesからは除く
-                route_length, next_route = self.__calcSuitableSum(first_list) # 緩和問題の解を取得
-                self.stack_search_nodes.insert(0, [first_list, next_route, route_length]) # stackする
+                route_length, next_reduced = self.__calcSuitableSum(first_list, parent_node) # 緩和問題の解を取得
+                if route_length != math.inf: # 緩和問題の解がinfのノードに一巡閉路はない
+                    self.stack_search_nodes.insert(0, [first_list, next_reduced, route_length]) # stackする
 
             if len(self.stack_search_nodes) == 0: # stackがなくなったら終了
                 break;
@@ -165,4 +185,4 @@ end_time = time.process_time()
 print(suitable_val)
 print(suitable_route)
 elapsed_time = end_time - start_time
-print(elapsed_time)
\ No newline at end of file
+print(elapsed_time)
@@ -0,0 +1,66 @@
+import numpy as np
+
+try: # Numba compiles the kernels below to native code, without it the solvers use their NumPy code
+    import numba
+except ImportError:
+    numba = None
+
+# Backends of the inner loops of the solvers: "numba" for the compiled kernels of this module, "numpy" for the
+# vectorized NumPy code, "auto" for "numba" when Numba is installed and "numpy" otherwise.
+# Both backends give exactly the same results: the kernels do the same operations in the same order.
+BACKENDS = ("auto", "numpy", "numba")
+
+# Return the backend ("numpy" or "numba") that backend selects
+def resolve_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError("unknown backend: {}, expected one of {}".format(backend, BACKENDS))
+    if backend == "auto":
+        return "numpy" if numba is None else "numba"
+    if backend == "numba" and numba is None:
+        raise ImportError("the numba backend needs Numba, install it with: pip install numba")
+    return backend
+
+# Kernel of fill_subsets in TSP_DP_en.py: fill dp[S][v] of the given subsets S from the layer of the size below.
+# The previous node u runs over every node, as in the NumPy code, so that the first minimum (argmin) is the same.
+def _fill_subsets(dp, parent, cost, masks, INF):
+    n = dp.shape[1]
+    for index in range(len(masks)):
+        S = masks[index]
+        for v in range(n):
+            if (S >> v) & 1 == 0: # S does not end at v
+                continue
+            rest = S ^ (1 << v)
+            best, best_u = dp[rest, 0] + cost[1, v + 1], 0 # dp[S - {v}][u] + c_uv, inf when u is not in S - {v}
+            for u in range(1, n):
+                candidate = dp[rest, u] + cost[u + 1, v + 1]
+                if candidate < best:
+                    best, best_u = candidate, u
+            dp[S, v] = min(best, INF)
+            parent[S, v] = best_u
+
+# Kernel of __reduceMatrix in TSP_BB_en.py: subtract the minimum of every active row (row_index) and then every active
+# column (col_index) of matrix, writing the minima to row_min and col_min. Return False, leaving matrix unchanged,
+# if a row or column is all inf.
+def _reduce_matrix(matrix, row_index, col_index, row_min, col_min):
+    for a in range(len(row_index)):
+        row_min[a] = np.inf
+        for b in range(len(col_index)):
+            row_min[a] = min(row_min[a], matrix[row_index[a], col_index[b]])
+        if row_min[a] == np.inf:
+            return False
+    for b in range(len(col_index)):
+        col_min[b] = np.inf
+        for a in range(len(row_index)):
+            col_min[b] = min(col_min[b], matrix[row_index[a], col_index[b]] - row_min[a])
+        if col_min[b] == np.inf:
+            return False
+    for a in range(len(row_index)):
+        for b in range(len(col_index)):
+            matrix[row_index[a], col_index[b]] = (matrix[row_index[a], col_index[b]] - row_min[a]) - col_min[b]
+    return True
+
+if numba is not None:
+    fill_subsets = numba.njit(cache=True)(_fill_subsets)
+    reduce_matrix = numba.njit(cache=True)(_reduce_matrix)
+else:
+    fill_subsets = reduce_matrix = None